@@ -1,3 +1,5 @@
+import random
+
 from . import program
 from . import variable
 from . import operation
@@ -30,6 +32,9 @@ class ScopeAnalyzer(Analyzer):
     def getVisibleVars(self):
         return [j for i in self.scopes for j in i]
 
+    def hasVisibleVars(self):
+        return any(len(i) > 0 for i in self.scopes)
+
     def getOuterVisibleVars(self):
         outerScopes = self.scopes[:-1]
         return [j for i in outerScopes for j in i]
@@ -115,8 +120,10 @@ class ContextAnalyzer(Analyzer):
 
 class TypeAnalyzer(Analyzer):
 
-    def __init__(self, programToAnalyze):
+    def __init__(self, programToAnalyze, environment=None):
         super(TypeAnalyzer, self).__init__(programToAnalyze)
+        # builtin_registry.Environment with the builtins the program can use
+        self.environment = environment
         self.variableTypes = [{}]
         self.stack = []
         self.returnStack = []
@@ -130,12 +137,19 @@ class TypeAnalyzer(Analyzer):
         for i in self.variableTypes:
             if var in i:
                 return i[var]
+        if self.environment is not None:
+            return self.environment.getType(var)
 
     def getSignature(self, var):
         if self.getType(var) == Types.Function:
-            return self.signatureTracker[var]
+            return self.trackedSignature(var)
         return False
 
+    def trackedSignature(self, var):
+        if var not in self.signatureTracker and self.environment is not None and var in self.environment:
+            return self.environment.getSignature(var)
+        return self.signatureTracker[var]
+
     def analyze(self, inst):
 
         if inst.getOpcode() == Opcode.LoadInteger:
@@ -245,7 +259,7 @@ class TypeAnalyzer(Analyzer):
             self.returnStack[-1].append(self.getType(inst.getInput(0)))
 
         if inst.getOpcode() == Opcode.CallFunction:
-            func = self.signatureTracker[inst.getInput()]
+            func = self.trackedSignature(inst.getInput())
             returnType = func.getReturnType()
             self.setType(inst.getAllOutputs(), returnType)
 
@@ -260,6 +274,86 @@ class TypeAnalyzer(Analyzer):
         # print self.variableTypes
 
 
+class VariablePool(Analyzer):
+
+    '''
+    Index of the visible variables by scope and type, kept up to date from the
+    scope and type analyzers so that a variable of a given type can be picked
+    without filtering a whole scope. It has to analyze an instruction after
+    both of them did.
+    '''
+    def __init__(self, programToAnalyze, scopeAnalyzer, typeAnalyzer):
+        super(VariablePool, self).__init__(programToAnalyze)
+        self.scopeAnalyzer = scopeAnalyzer
+        self.typeAnalyzer = typeAnalyzer
+        # one dict per scope from type to the variables of that type
+        self.pools = [{}]
+        # one dict per scope from variable to the type it is indexed under
+        self.types = [{}]
+
+    def choose(self, level, dtype):
+        '''A random variable of scope level with type dtype or Unknown, None if there is none'''
+        pool = self.pools[level]
+        typed = pool.get(dtype, ())
+        unknown = pool.get(Types.Unknown, ()) if dtype != Types.Unknown else ()
+        total = len(typed) + len(unknown)
+        if total == 0:
+            return None
+        idx = random.randrange(total)
+        if idx < len(typed):
+            return typed[idx]
+        return unknown[idx - len(typed)]
+
+    def rebuild(self):
+        self.pools = [{} for _ in self.scopeAnalyzer.scopes]
+        self.types = [{} for _ in self.scopeAnalyzer.scopes]
+        for level, scope in enumerate(self.scopeAnalyzer.scopes):
+            for var in scope:
+                self._index(level, var, self.typeAnalyzer.getType(var))
+
+    def _index(self, level, var, dtype):
+        self.types[level][var] = dtype
+        self.pools[level].setdefault(dtype, []).append(var)
+
+    def _update(self, var):
+        scopes = self.scopeAnalyzer.scopes
+        for level in range(len(scopes)-1, -1, -1):
+            if var in scopes[level]:
+                break
+        else:
+            return
+
+        dtype = self.typeAnalyzer.getType(var)
+        types = self.types[level]
+        if var in types:
+            if types[var] == dtype:
+                return
+            self.pools[level][types[var]].remove(var)
+        self._index(level, var, dtype)
+
+    def analyze(self, inst):
+
+        if inst.isEndFunction():
+            # leaving the function drops its type frame, which can change the type of any variable
+            self.rebuild()
+            return
+
+        if inst.isBlockEnd():
+            self.pools.pop()
+            self.types.pop()
+
+        if inst.isBlockBegin():
+            self.pools.append({})
+            self.types.append({})
+
+        for var in inst.getAllOutputs():
+            self._update(var)
+        for var in inst.getAllTemps():
+            self._update(var)
+        for var in inst.getAllInputs():
+            if isinstance(var, variable.Variable):
+                self._update(var)
+
 
 # Tests ->
 
@@ -0,0 +1,157 @@
+import os
+import json
+import pickle
+import logging
+
+from . import typesData
+from . import variable
+
+logger = logging.getLogger('BuiltinRegistry')
+
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils')
+BUILTIN_FUNC_MAP = os.path.join(UTILS_DIR, 'builtin_func_map.json')
+# parsed form of BUILTIN_FUNC_MAP, regenerated whenever the json is newer
+BUILTIN_FUNC_CACHE = os.path.join(UTILS_DIR, 'builtin_func_map.pickle')
+# bump when the layout of the cached entries changes
+CACHE_VERSION = 1
+
+BLACK_LIST = ['posix_kill', 'sleep', 'time_sleep_unti']
+
+_TYPES = {
+    'Types.Null': typesData.Types.Null,
+    'Types.Integer': typesData.Types.Integer,
+    'Types.Float': typesData.Types.Float,
+    'Types.String': typesData.Types.String,
+    'Types.Boolean': typesData.Types.Boolean,
+    'Types.Object': typesData.Types.Object,
+    'Types.Function': typesData.Types.Function,
+    'Types.Class': typesData.Types.Class,
+    'Types.Array': typesData.Types.Array,
+    'Types.Builtin': typesData.Types.Builtin,
+    'Types.Unknown': typesData.Types.Unknown,
+    # the extractor uses these when it could not tell the type of an argument
+    'Anything': typesData.Types.Unknown,
+    'Variadic': typesData.Types.Unknown,
+}
+
+def _parseType(name):
+    '''Types are written like their python expression, e.g. "Types.Float | Types.Integer"'''
+    dtype = 0
+    for part in name.split('|'):
+        dtype |= _TYPES[part.strip()]
+    return dtype
+
+class Builtin:
+    '''
+    A builtin function of php. The signature is shared by every program that
+    uses the builtin, nothing is allowed to modify it.
+    '''
+    def __init__(self, name, numArgs, argTypes):
+        self.name = name
+        self.signature = typesData.FunctionSignature(numArgs, [])
+        self.signature.setInputTypes(argTypes)
+
+    def __repr__(self):
+        return self.name
+
+
+def parseBuiltinFuncs(path=BUILTIN_FUNC_MAP):
+    '''
+    Parse the json written by utils/extract_builtin_funcs.py into (name, number of arguments, argument types)
+    entries, leaving out the functions we cannot call
+    '''
+    with open(path, 'r') as f:
+        func_map = json.load(f)
+
+    retval = []
+    for item in func_map:
+        if item['name'] in BLACK_LIST:
+            continue
+        # TODO: we currently do not handle functions that take in resource-like object as input
+        if 'Types.Unknown' in item['arg_types'] or 'Types.Class' in item['arg_types']:
+            continue
+        retval.append((item['name'], item['arg_num'], [_parseType(x) for x in item['arg_types']]))
+    return retval
+
+def _loadCache(path, source):
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+    except Exception as e:
+        logger.warning("Could not load %s: %r" % (path, e))
+        return None
+    if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+        return None
+    return cache['builtins']
+
+def _storeCache(path, entries):
+    tmp = "%s.%d" % (path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'builtins': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # workers may race to write the cache, the rename keeps readers from seeing half of it
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Could not write %s: %r" % (path, e))
+
+def loadBuiltins(source=BUILTIN_FUNC_MAP, cache=BUILTIN_FUNC_CACHE):
+    entries = _loadCache(cache, source)
+    if entries is None:
+        entries = parseBuiltinFuncs(source)
+        _storeCache(cache, entries)
+    return [Builtin(name, numArgs, argTypes) for name, numArgs, argTypes in entries]
+
+_builtins = None
+
+def getBuiltins():
+    '''The builtins of php, loaded once per process'''
+    global _builtins
+    if _builtins is None:
+        _builtins = loadBuiltins()
+    return _builtins
+
+
+class Environment:
+    '''
+    The builtins as seen by the analyzers: one variable per builtin, typed as a
+    function with the builtin's signature. The environment is shared by all
+    programs and never changes, so programs only hold the code that uses it.
+    Builtin variables have negative ids, which never clash with the ids
+    ProgramBuilder gives out.
+    '''
+    def __init__(self, builtins):
+        self.builtins = []
+        self.signatures = {}
+        self.names = {}
+        for idx, builtin in enumerate(builtins):
+            var = variable.Variable(-(idx+1))
+            var.set_repr(builtin.name)
+            self.builtins.append(var)
+            self.signatures[var] = builtin.signature
+            self.names[builtin.name] = var
+
+    def __contains__(self, var):
+        return var in self.signatures
+
+    def getType(self, var):
+        if var in self.signatures:
+            return typesData.Types.Function
+        return None
+
+    def getSignature(self, var):
+        return self.signatures[var]
+
+    def lookup(self, name):
+        '''The variable of the builtin called name, None if there is no such builtin'''
+        return self.names.get(name)
+
+_environment = None
+
+def getEnvironment():
+    '''The environment of the builtins of php, created once per process'''
+    global _environment
+    if _environment is None:
+        _environment = Environment(getBuiltins())
+    return _environment
@@ -1,23 +1,41 @@
 class CodeEmitter:
 
+    header = "<?php\n"
+    footer = "\necho \"Done\";\n?>"
+    indent = "   "
+
     def __init__(self):
-        self.code = ""
+        # the code is kept as a list of lines and only joined when asked for
+        self.chunks = []
         self.indentLevel = 0
+        self._indents = [""]
 
     def emit(self, text):
-        self.code += "   "*self.indentLevel + text + "\n"
+        self.chunks.append(self._indents[self.indentLevel] + text + "\n")
 
     def emitline(self, line):
         self.emit(line + ";")
 
     def increaseIndentLevel(self):
         self.indentLevel += 1
+        if self.indentLevel == len(self._indents):
+            self._indents.append(self.indent * self.indentLevel)
 
     def decreaseIndentLevel(self):
         self.indentLevel -= 1
 
+    @property
+    def code(self):
+        return "".join(self.chunks)
+
     def getCode(self):
-        return "<?php\n"+self.code+"\necho \"Done\";\n?>"
+        return self.header + self.code + self.footer
+
+    def write_to(self, fileobj):
+        '''Write the code to a file object without building it in memory first'''
+        fileobj.write(self.header)
+        fileobj.writelines(self.chunks)
+        fileobj.write(self.footer)
 
     def __str__(self):
         return self.getCode()
@@ -127,6 +127,7 @@ class CodeGenerator:
         programBuilder.unaryOperation("++", loopVar)
         programBuilder.generateRandomInst()
         programBuilder.endDoWhile(loopVar, "<", end)
+        return True
 
     @staticmethod
     def ifStatementGenerator(programBuilder):
@@ -155,6 +156,7 @@ class CodeGenerator:
         programBuilder.beginFor(start, "<", end, "+", step)
         programBuilder.generateRandomInst()
         programBuilder.endFor()
+        return True
 
 
     @staticmethod
@@ -234,12 +236,14 @@ class CodeGenerator:
         # programBuilder.generateRandomInst()
         programBuilder.copy(programBuilder.randVar(), v)
         programBuilder.endTryCatch()
+        return True
 
     @staticmethod
     def throwGenerator(programBuilder):
         # print "throwGenerator"
         v = programBuilder.randVar()
         programBuilder.throwException(v)
+        return True
 
     @staticmethod
     def arrayLiteralGenerator(programBuilder):
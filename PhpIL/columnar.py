@@ -0,0 +1,169 @@
+from array import array
+
+from . import program
+from . import instructions
+from . import operation
+from . import variable
+
+# every operation class, the kind column indexes this list
+OPERATIONS = [cls for cls in operation.Operation.__subclasses__()]
+KINDS = {cls: idx for idx, cls in enumerate(OPERATIONS)}
+# the opcode and flags of every kind, so that they can be looked up without the operation
+OPCODES = array('i', [getattr(cls.opcode, 'value', -1) for cls in OPERATIONS])
+FLAGS = array('i', [cls.flags for cls in OPERATIONS])
+
+def parameterNames(cls):
+    '''The attributes an operation of class cls is made of, empty for the shared parameterless ones'''
+    return cls.__dict__.get('__slots__', ())
+
+class ColumnarProgram:
+    '''
+    A program as flat columns instead of a list of Instruction objects:
+
+        kinds, opcodes                      one entry per instruction
+        inputs, outputs, temps              the variable ids of all instructions, back to back
+        inputOffsets, outputOffsets, ...    where the ids of instruction i start, with one extra
+                                            entry at the end, so instruction i has
+                                            inputs[inputOffsets[i]:inputOffsets[i+1]]
+
+    All of these are array('i'). What does not fit in an int is kept on the side:
+    the attributes of parametric operations (literals, operators, signatures)
+    in parameters, indexed by parameterIndex (-1 for operations without any),
+    the inputs that are no variables (the (key, value) pairs of CreateDict) in
+    rawInputs by their position in inputs, which holds 0 for them, and the
+    names of variables that have one (builtins) in reprs.
+
+    Code that only looks at opcodes, block structure or def-use can scan the
+    arrays without touching an object, and toProgram() gives back an equal
+    program in the object form.
+    '''
+    def __init__(self):
+        self.kinds = array('i')
+        self.opcodes = array('i')
+        self.inputs = array('i')
+        self.outputs = array('i')
+        self.temps = array('i')
+        self.inputOffsets = array('i', [0])
+        self.outputOffsets = array('i', [0])
+        self.tempOffsets = array('i', [0])
+        self.parameterIndex = array('i')
+        self.parameters = []
+        self.rawInputs = {}
+        self.reprs = {}
+        self.nextVariable = 0
+
+    @classmethod
+    def fromProgram(cls, prog):
+        columns = cls()
+        columns.nextVariable = prog.nextVariable
+        for inst in prog.instructionList:
+            columns.append(inst)
+        return columns
+
+    def _addVariables(self, column, variables):
+        for var in variables:
+            column.append(var.id)
+            if var._repr is not None:
+                self.reprs[var.id] = var._repr
+
+    def append(self, inst):
+        '''Add an instruction at the end'''
+        op = inst.operation
+        kind = KINDS[type(op)]
+        self.kinds.append(kind)
+        self.opcodes.append(OPCODES[kind])
+
+        names = parameterNames(type(op))
+        if len(names) > 0:
+            self.parameterIndex.append(len(self.parameters))
+            self.parameters.append(tuple(getattr(op, name) for name in names))
+        else:
+            self.parameterIndex.append(-1)
+
+        for inp in inst.inputs:
+            if isinstance(inp, variable.Variable):
+                self._addVariables(self.inputs, [inp])
+            else:
+                self.rawInputs[len(self.inputs)] = inp
+                self.inputs.append(0)
+        self._addVariables(self.outputs, inst.outputs)
+        self._addVariables(self.temps, inst.temp)
+        self.inputOffsets.append(len(self.inputs))
+        self.outputOffsets.append(len(self.outputs))
+        self.tempOffsets.append(len(self.temps))
+
+    def __len__(self):
+        return len(self.kinds)
+
+    '''Accessors for instruction idx'''
+
+    def getOperationClass(self, idx):
+        return OPERATIONS[self.kinds[idx]]
+
+    def getFlags(self, idx):
+        return FLAGS[self.kinds[idx]]
+
+    def isBlockBegin(self, idx):
+        return FLAGS[self.kinds[idx]] & operation.Operation.Attributes.isBlockBegin != 0
+
+    def isBlockEnd(self, idx):
+        return FLAGS[self.kinds[idx]] & operation.Operation.Attributes.isBlockEnd != 0
+
+    def getParameters(self, idx):
+        pos = self.parameterIndex[idx]
+        if pos < 0:
+            return ()
+        return self.parameters[pos]
+
+    '''The variable ids of instruction idx, inputs that are no variables are 0 here, see rawInputs'''
+    def getInputs(self, idx):
+        return self.inputs[self.inputOffsets[idx]:self.inputOffsets[idx+1]]
+
+    def getOutputs(self, idx):
+        return self.outputs[self.outputOffsets[idx]:self.outputOffsets[idx+1]]
+
+    def getTemps(self, idx):
+        return self.temps[self.tempOffsets[idx]:self.tempOffsets[idx+1]]
+
+    '''Back to the object form'''
+
+    def _variables(self):
+        '''One variable for every id in the program'''
+        cache = {}
+        for varId in set(self.inputs).union(self.outputs, self.temps):
+            var = variable.Variable(varId)
+            var._repr = self.reprs.get(varId)
+            cache[varId] = var
+        return cache
+
+    def _operation(self, idx):
+        cls = OPERATIONS[self.kinds[idx]]
+        pos = self.parameterIndex[idx]
+        if pos < 0:
+            return cls()
+        op = object.__new__(cls)
+        for name, value in zip(parameterNames(cls), self.parameters[pos]):
+            setattr(op, name, value)
+        return op
+
+    def toInstruction(self, idx, cache=None):
+        '''Instruction idx as an Instruction, cache maps ids to the variables to use'''
+        if cache is None:
+            cache = self._variables()
+        start = self.inputOffsets[idx]
+        inputs = [cache[varId] for varId in self.getInputs(idx)]
+        if len(self.rawInputs) > 0:
+            for pos in range(start, self.inputOffsets[idx+1]):
+                if pos in self.rawInputs:
+                    inputs[pos-start] = self.rawInputs[pos]
+        inst = instructions.Instruction(self._operation(idx))
+        inst.inputs = inputs
+        inst.outputs = [cache[varId] for varId in self.getOutputs(idx)]
+        inst.temp = [cache[varId] for varId in self.getTemps(idx)]
+        return inst
+
+    def toProgram(self):
+        cache = self._variables()
+        prog = program.Program([self.toInstruction(idx, cache) for idx in range(len(self))])
+        prog.nextVariable = self.nextVariable
+        return prog
@@ -0,0 +1,110 @@
+import os
+import random
+import hashlib
+import logging
+
+from . import serializer
+
+logger = logging.getLogger('Corpus')
+
+class Corpus:
+    '''
+    Keeps the programs that found new coverage so that they can be reused.
+    Every program is weighted by the number of new edges it found, which
+    decides both how often it is picked and which program is evicted when
+    the corpus is full.
+
+    With a directory, every program kept is also saved there in the format of
+    serializer.py as <new edges>-<hash>.phpil and deleted when it is evicted,
+    so load() can pick the corpus up again.
+    '''
+    def __init__(self, maxSize=1000, directory=None):
+        '''
+        @param maxSize:         The maximum number of programs kept
+        @param directory:       Where the programs are saved, None to keep them in memory only
+        '''
+        self.maxSize = maxSize
+        self.directory = directory
+        self.programs = []
+        self.weights = []
+        self.files = []
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self.programs)
+
+    def add(self, prog, newEdges):
+        '''
+        Add a program that found newEdges new edges. Returns whether it was kept.
+        '''
+        if newEdges <= 0:
+            return False
+
+        if len(self.programs) >= self.maxSize:
+            idx = min(range(len(self.weights)), key=self.weights.__getitem__)
+            if self.weights[idx] >= newEdges:
+                logger.debug("Corpus is full, dropping program with %d new edges" % newEdges)
+                return False
+            logger.debug("Evicting program with %d new edges" % self.weights[idx])
+            path = self.files[idx]
+            self.programs[idx] = self.programs[-1]
+            self.weights[idx] = self.weights[-1]
+            self.files[idx] = self.files[-1]
+            self.programs.pop()
+            self.weights.pop()
+            self.files.pop()
+            # the same program can be kept twice under one file
+            if path is not None and path not in self.files:
+                os.unlink(path)
+
+        self.programs.append(prog)
+        self.weights.append(newEdges)
+        self.files.append(self._save(prog, newEdges))
+        logger.info("Added program with %d new edges, corpus size %d" % (newEdges, len(self.programs)))
+        return True
+
+    def _save(self, prog, newEdges):
+        if self.directory is None:
+            return None
+        data = serializer.serialize(prog)
+        path = os.path.join(self.directory, "%d-%s.phpil" % (newEdges, hashlib.sha1(data).hexdigest()[:16]))
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def load(self):
+        '''
+        Add the programs saved in the directory, returns how many were added. The files
+        of the programs that do not fit are skipped and left on disk, only add deletes
+        the files of the programs it evicts
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            edges = name.split('-', 1)[0]
+            if name.endswith('.phpil') and edges.isdigit():
+                entries.append((int(edges), os.path.join(self.directory, name)))
+
+        # the best programs first, so the ones that do not fit are the worst
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        loaded = 0
+        for newEdges, path in entries:
+            if len(self.programs) >= self.maxSize:
+                continue
+            try:
+                prog = serializer.load(path)
+            except (OSError, ValueError) as e:
+                logger.warning("Cannot load %s: %r" % (path, e))
+                continue
+            self.programs.append(prog)
+            self.weights.append(newEdges)
+            self.files.append(path)
+            loaded += 1
+        logger.info("Loaded %d programs from %s" % (loaded, self.directory))
+        return loaded
+
+    def randomElement(self):
+        '''Pick a program, programs that found more edges are picked more often'''
+        if len(self.programs) == 0:
+            return None
+        return random.choices(self.programs, weights=self.weights)[0]
@@ -1,30 +1,125 @@
 import os
 import sys
-import json
+import mmap
+import struct
 import logging
-import subprocess
+import functools
+from multiprocessing import shared_memory
+
+import numpy as np
 import pwnlib
 
 logger = logging.getLogger('Coverage')
 
+# must match SHM_SIZE in fuzzer/shmcov.c
+SHM_SIZE = 0x100000
+
+# magic words at the start of a .sancov file, see sancov.py
+kMagic32SecondHalf = 0xFFFFFF32
+kMagic64SecondHalf = 0xFFFFFF64
+kMagicFirstHalf    = 0xC0BFFFFF
+
+def read_magic_and_return_bitness(buf, path):
+    magic_words = struct.unpack_from('II', buf)
+    bits = 0
+    idx = 1 if sys.byteorder == 'little' else 0
+    if magic_words[idx] == kMagicFirstHalf:
+        if magic_words[1-idx] == kMagic64SecondHalf:
+            bits = 64
+        elif magic_words[1-idx] == kMagic32SecondHalf:
+            bits = 32
+    if bits == 0:
+        raise Exception('Bad magic word in %s' % path)
+    return bits
+
+def read_sancov(path):
+    '''
+    Read the PCs in a .sancov file into a uint64 array without going through sancov.py
+    '''
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < 8:
+            raise Exception('File %s is short (< 8 bytes)' % path)
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            bits = read_magic_and_return_bitness(mm, path)
+            dtype = np.uint64 if bits == 64 else np.uint32
+            count = (size - 8) * 8 // bits
+            # astype copies, so the array outlives the mapping
+            return np.frombuffer(mm, dtype=dtype, count=count, offset=8).astype(np.uint64)
+
+def merge_sancov(paths):
+    '''
+    Read several .sancov files into one sorted array of unique PCs
+    '''
+    if len(paths) == 0:
+        return np.empty(0, dtype=np.uint64)
+    return functools.reduce(np.union1d, (read_sancov(path) for path in paths), np.empty(0, dtype=np.uint64))
+
+# number of slots in the edge map of Coverage, edges are hashed into it
+EDGE_MAP_SIZE = 1 << 20
+EDGE_MAP_MAGIC = b'PHCV'
+EDGE_MAP_VERSION = 1
+
+def edge_ids(pc_addrs):
+    '''
+    Hash every pair of consecutive PCs into a slot of the edge map
+    '''
+    pc_addrs = np.asarray(pc_addrs, dtype=np.uint64)
+    h = (pc_addrs[:-1] * np.uint64(0x9E3779B97F4A7C15)) ^ pc_addrs[1:]
+    h ^= h >> np.uint64(29)
+    return (h & np.uint64(EDGE_MAP_SIZE - 1)).astype(np.intp)
+
+def dump_edge_map(path, virgin):
+    '''
+    Write an edge map as a small header followed by one bit per slot, set for the seen edges
+    '''
+    virgin = np.frombuffer(virgin, dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sII', EDGE_MAP_MAGIC, EDGE_MAP_VERSION, len(virgin)))
+        f.write(np.packbits(virgin == 0).tobytes())
+
+def load_edge_map(path):
+    '''
+    Read an edge map written by dump_edge_map, returns the virgin map
+    '''
+    with open(path, 'rb') as f:
+        magic, version, size = struct.unpack('<4sII', f.read(12))
+        if magic != EDGE_MAP_MAGIC or version != EDGE_MAP_VERSION:
+            raise Exception('%s is not a version %d edge map' % (path, EDGE_MAP_VERSION))
+        seen = np.unpackbits(np.frombuffer(f.read(), dtype=np.uint8), count=size)
+    return (seen == 0).astype(np.uint8)
+
 class Coverage:
     '''
+    Edge coverage from the .sancov files ASAN writes. Edges are hashed into a
+    fixed size map that holds 1 for every slot not seen yet.
     '''
-    def __init__(self, sancov_script, report_path=None, output_dir=None):
+    def __init__(self, sancov_script=None, report_path=None, output_dir=None, virgin=None):
+        '''
+        @param virgin:          A writable buffer of EDGE_MAP_SIZE bytes to use as the edge map.
+                                Passing the same buffer to several instances shares the coverage.
+        '''
         self._script_path = sancov_script
         self._report_path = report_path
         self._output_dir = output_dir
-        self._hash_map = {}
-    
-    def _make_hash(self, e1, e2):
-        return f'{hex(e1)}-{hex(e2)}'
-    
-    def _mark_edge_uncovered(self, key):
-        self._hash_map[key] = True
-    
-    def _edge_is_uncovered(self, key):
-        return key in self._hash_map and self._hash_map[key] is True
-    
+        if virgin is None:
+            self._virgin = np.ones(EDGE_MAP_SIZE, dtype=np.uint8)
+        else:
+            self._virgin = np.frombuffer(virgin, dtype=np.uint8)
+            assert len(self._virgin) == EDGE_MAP_SIZE, "Virgin map does not match the edge map size"
+        self._num_edges = 0
+        # the number of new edges of the last analyze()
+        self.last_new_edges = 0
+
+    @property
+    def num_edges(self):
+        '''The number of edges this instance found first'''
+        return self._num_edges
+
+    def load_coverage(self, filename='coverage.bin'):
+        self._virgin[:] = load_edge_map(f'{self._output_dir}/{filename}')
+        self._num_edges = EDGE_MAP_SIZE - int(np.count_nonzero(self._virgin))
+
     @property
     def report_path(self):
         return self._report_path
@@ -33,20 +128,24 @@ class Coverage:
     def report_path(self, new_path):
         self._report_path = new_path
     
-    def dump_coverage(self, filename='coverage.json'):
-        if len(self._hash_map) == 0:
+    def dump_coverage(self, filename='coverage.bin'):
+        if self._num_edges == 0:
             logger.info("No coverages to dump")
             return
-        
-        with open(f'{self._output_dir}/{filename}', 'w') as f:
-            json.dump(self._hash_map, f, indent=2)
 
-    def find_reports(self, report_dir):
+        dump_edge_map(f'{self._output_dir}/{filename}', self._virgin)
+
+    def find_reports(self, report_dir, pid=None):
+        '''
+        The .sancov files in report_dir, only the ones of the process pid if it is given.
+        ASAN names them <binary>.<pid>.sancov
+        '''
         report_paths = []
         logger.debug("Looking for sancov files in %s" % report_dir)
+        suffix = '.sancov' if pid is None else f'.{pid}.sancov'
 
         for report_file in os.listdir(report_dir):
-            if not report_file.endswith('.sancov'):
+            if not report_file.endswith(suffix):
                 logger.debug("Discarding %s since it doesn't end with .sancov" % report_file)
                 continue
             report_paths.append(os.path.abspath(os.path.join(report_dir, report_file)))
@@ -54,37 +153,53 @@ class Coverage:
         logger.debug("Found %d sancov files in %s" % (len(report_paths), report_dir))
         return report_paths
     
-    def clear_reports(self, report_dir):
+    def clear_reports(self, report_dir, pid=None):
+        suffix = '.sancov' if pid is None else f'.{pid}.sancov'
         for report_file in os.listdir(report_dir):
-            if not report_file.endswith('.sancov'):
+            if not report_file.endswith(suffix):
                 continue
             logger.debug("Removing sancov report %s" % report_file)
             os.remove(os.path.abspath(os.path.join(report_dir, report_file)))
     
-    def analyze(self, dump_source=False, obj=None, report_file=None):
+    def analyze(self, dump_source=False, obj=None, report_file=None, update=True):
+        '''
+        @param report_file:     A .sancov file or a list of them, which are merged
+        @param update:          Mark the new edges as seen, otherwise they are only counted
+        The number of new edges is kept in last_new_edges.
+        '''
         if self._report_path is None:
             assert report_file is not None, "Sancov file not specified"
             self._report_path = report_file
         elif report_file is not None:
             self._report_path = report_file
 
-        err = ''
-        logger.info("Using pwn module")
-        output = pwnlib.tubes.process.process([f'{self._script_path}', 'print', f'{self._report_path}'], stderr=subprocess.PIPE).recvall().strip().decode('utf-8')
-        
+        if isinstance(self._report_path, list):
+            pc_addrs = merge_sancov(self._report_path)
+        else:
+            # sorted and unique, like the output of sancov.py print
+            pc_addrs = np.unique(read_sancov(self._report_path))
+
         if not dump_source:
-            pc_addrs = list(map(lambda x: int(x, 16), output.splitlines()))
             logger.info("Found %d PC values" % len(pc_addrs))
-            logger.info("Marking edges in hash map")
-            old_edges = len(self._hash_map)
-            for idx in range(len(pc_addrs)-1):
-                key = self._make_hash(pc_addrs[idx], pc_addrs[idx+1])
-                self._mark_edge_uncovered(key)
-            new_edges = len(self._hash_map)
-            logger.info("Found %d new edges" % (new_edges-old_edges))
+            logger.info("Marking edges in edge map")
+            ids = edge_ids(pc_addrs)
+            # the same slot can show up more than once in ids, so count after deduplicating
+            new_ids = np.unique(ids[self._virgin[ids] == 1])
+            self.last_new_edges = len(new_ids)
+            logger.info("Found %d new edges" % len(new_ids))
+            if update:
+                self._virgin[new_ids] = 0
+                self._num_edges += len(new_ids)
             return pc_addrs
         
-        return set(list(self._pc_addrs_to_source(output.splitlines(), obj).values()))
+        return set(list(self._pc_addrs_to_source([hex(x) for x in pc_addrs], obj).values()))
+
+    def mark_seen(self, pc_addrs):
+        '''
+        Mark the edges of pc_addrs, as returned by analyze, as seen without
+        counting them as found by this instance
+        '''
+        self._virgin[edge_ids(pc_addrs)] = 0
 
     def _pc_addrs_to_source(self, pc_addrs, obj):
         assert obj is not None, "Binary object is required to dump source code"
@@ -124,3 +239,80 @@ class Coverage:
 
         logger.debug("Function %s in file %s @ %s" % (func_name, filename, line_num))
         return {'function': func_name, 'filename': filename, 'line': line_num}
+
+
+class SharedMemoryCoverage:
+    '''
+    Edge coverage collected through a bitmap that the target writes into shared
+    memory (see fuzzer/shmcov.c), so no report files have to be read.
+    '''
+    def __init__(self, output_dir=None, virgin=None, lock=None):
+        '''
+        @param output_dir:      The directory to dump the coverage in
+        @param virgin:          A writable buffer with a set bit for every edge not seen yet.
+                                Passing the same buffer to several instances shares the coverage.
+        @param lock:            A lock guarding the virgin map when it is shared
+        '''
+        self._output_dir = output_dir
+        self._shm = shared_memory.SharedMemory(create=True, size=SHM_SIZE)
+        self._bitmap = self._shm.buf[4:]
+        self._zero = bytes(len(self._bitmap))
+        if virgin is None:
+            virgin = bytearray(b'\xff' * len(self._bitmap))
+        assert len(virgin) == len(self._bitmap), "Virgin map does not match the bitmap size"
+        self._virgin = virgin
+        self._lock = lock
+
+    @property
+    def shm_id(self):
+        return f'/{self._shm.name}'
+
+    @property
+    def num_edges(self):
+        '''The number of edges seen so far'''
+        return len(self._virgin) * 8 - bin(int.from_bytes(self._virgin, 'little')).count('1')
+
+    @property
+    def registered_edges(self):
+        '''The number of edges the target registered'''
+        return struct.unpack_from('I', self._shm.buf, 0)[0]
+
+    def env(self):
+        '''The environment the target needs to find the shared memory'''
+        return {'SHM_ID': self.shm_id}
+
+    def analyze(self, update=True):
+        '''
+        Diff the bitmap of the last execution against the virgin map, clear the
+        newly found edges from it unless update is False and reset the bitmap
+        for the next execution. Returns the number of new edges.
+        '''
+        current = int.from_bytes(self._bitmap, 'little')
+        if current == 0:
+            logger.info("No edges in the coverage bitmap")
+            return 0
+        self._bitmap[:] = self._zero
+
+        if self._lock is not None:
+            self._lock.acquire()
+        try:
+            virgin = int.from_bytes(self._virgin, 'little')
+            new = current & virgin
+            if new and update:
+                self._virgin[:] = (virgin ^ new).to_bytes(len(self._virgin), 'little')
+        finally:
+            if self._lock is not None:
+                self._lock.release()
+
+        new_edges = bin(new).count('1')
+        logger.info("Found %d new edges" % new_edges)
+        return new_edges
+
+    def dump_coverage(self, filename='coverage.bitmap'):
+        with open(f'{self._output_dir}/{filename}', 'wb') as f:
+            f.write(self._virgin)
+
+    def close(self):
+        self._bitmap.release()
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,184 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger('CrashTriage')
+
+# number of stack frames that make up the signature of a crash
+NUM_FRAMES = 5
+# number of inputs kept on disk for every signature
+MAX_EXEMPLARS = 3
+
+# "==123==ERROR: AddressSanitizer: heap-use-after-free on address ..."
+SANITIZER_ERROR_RE = re.compile(r'ERROR: (\w+)Sanitizer: ([\w-]+)')
+# "READ of size 8 at ..." or "The signal is caused by a WRITE memory access."
+ACCESS_RE = re.compile(r'\b(READ|WRITE) (?:of size|memory access)')
+# "#0 0x55d0c1 in zend_hash_find /src/Zend/zend_hash.c:123:5" or "#2 0x7f01 (/lib/libc.so.6+0x29d90)"
+FRAME_RE = re.compile(r'^\s*#(\d+) 0x[0-9a-fA-F]+ (?:in (\S+) ?)?(.*)$')
+# frames of the sanitizer runtime and of libc say nothing about where the bug is
+IGNORED_FUNCTIONS = re.compile(r'^(__asan|__interceptor|__sanitizer|__lsan|__ubsan|__GI_|__libc_|_start$|abort$|raise$)')
+IGNORED_MODULES = re.compile(r'(libasan|libclang_rt|libc\.so|libc-|ld-linux|libpthread)')
+
+class Signature:
+    '''
+    What tells a crash apart from other crashes: the kind of bug the
+    sanitizer reports and the top frames of the stack it crashed in. Crashes
+    without a sanitizer report only have their exit code.
+    '''
+    def __init__(self, kind, frames, access=None):
+        self.kind = kind
+        self.frames = frames
+        self.access = access
+
+    @property
+    def bucket(self):
+        '''The name of the signature, usable as a directory name'''
+        digest = hashlib.sha1("\n".join([self.kind, self.access or ""] + self.frames).encode('utf-8')).hexdigest()
+        return f"{self.kind}-{digest[:12]}"
+
+    def __repr__(self):
+        return f"{self.kind} {self.access or ''} {' < '.join(self.frames)}"
+
+def _frame_name(function, location):
+    if function is not None:
+        if IGNORED_FUNCTIONS.match(function):
+            return None
+        return function
+    # no symbol, "(/path/module+0xoffset)"
+    location = location.strip('()')
+    if IGNORED_MODULES.search(location):
+        return None
+    return os.path.basename(location)
+
+def parse_frames(report):
+    '''The frames of the first stack in report, which is where the sanitizer stopped the process'''
+    frames = []
+    for line in report.splitlines():
+        match = FRAME_RE.match(line)
+        if match is None:
+            if len(frames) > 0:
+                break
+            continue
+        if int(match.group(1)) == 0 and len(frames) > 0:
+            break
+        frames.append((match.group(2), match.group(3)))
+    return frames
+
+def crash_signature(exit_code, stderr, num_frames=NUM_FRAMES):
+    '''The signature of a crash from the sanitizer report in its stderr'''
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode('utf-8', errors='replace')
+    stderr = stderr or ''
+
+    match = SANITIZER_ERROR_RE.search(stderr)
+    if match is None:
+        return Signature(f"exit{exit_code}", [])
+    kind = 'memory-leak' if match.group(1) == 'Leak' else match.group(2)
+    report = stderr[match.end():]
+
+    access = ACCESS_RE.search(report)
+    names = []
+    for function, location in parse_frames(report):
+        name = _frame_name(function, location)
+        if name is not None:
+            names.append(name)
+        if len(names) == num_frames:
+            break
+    return Signature(kind, names, None if access is None else access.group(1))
+
+class CrashStore:
+    '''
+    Crashes bucketed by their signature in a directory on disk:
+
+        <directory>/<bucket>/info.json      signature of the bucket
+        <directory>/<bucket>/hits           one byte for every crash with this signature
+        <directory>/<bucket>/<n>.php        the n-th input kept for this signature
+        <directory>/<bucket>/<n>.txt        its output and stderr
+        <directory>/<bucket>/minimized.php  a minimized input, see minimizer.py
+
+    Only max_exemplars inputs are kept for a signature, so a bug that is hit
+    over and over only costs a byte per hit. Several processes can share the
+    directory, the inputs are claimed with O_EXCL and the hits are appended.
+    '''
+    def __init__(self, directory, max_exemplars=MAX_EXEMPLARS, num_frames=NUM_FRAMES):
+        self.directory = directory
+        self.max_exemplars = max_exemplars
+        self.num_frames = num_frames
+        # buckets whose exemplars this process saw taken, so it does not try to claim one again
+        self._full = set()
+        self.hits = defaultdict(int)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def add(self, exit_code, code, output, stderr=None):
+        '''Record a crash, returns its bucket and whether the bucket is new'''
+        signature = crash_signature(exit_code, stderr, self.num_frames)
+        bucket = signature.bucket
+        bucket_dir = os.path.join(self.directory, bucket)
+        try:
+            os.mkdir(bucket_dir)
+            new = True
+            logger.info("New crash %s: %r" % (bucket, signature))
+        except FileExistsError:
+            new = False
+
+        with open(os.path.join(bucket_dir, 'hits'), 'ab') as f:
+            f.write(b'.')
+        self.hits[bucket] += 1
+
+        if bucket not in self._full:
+            slot = self._claim(bucket_dir)
+            if slot is None:
+                self._full.add(bucket)
+            else:
+                self._save(bucket_dir, slot, signature, exit_code, code, output, stderr)
+        return bucket, new
+
+    def _claim(self, bucket_dir):
+        for idx in range(self.max_exemplars):
+            try:
+                fd = os.open(os.path.join(bucket_dir, f'{idx}.php'), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                continue
+            return idx, fd
+        return None
+
+    def _save(self, bucket_dir, slot, signature, exit_code, code, output, stderr):
+        idx, fd = slot
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(code))
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode('utf-8', errors='replace')
+        with open(os.path.join(bucket_dir, f'{idx}.txt'), 'w') as f:
+            f.write(f"exit code: {exit_code}\n\n{output}\n\n{stderr or ''}")
+        if idx == 0:
+            info = {'kind': signature.kind, 'access': signature.access, 'frames': signature.frames,
+                    'exit_code': exit_code, 'time': time.time()}
+            with open(os.path.join(bucket_dir, 'info.json'), 'w') as f:
+                json.dump(info, f, indent=2)
+
+    def save_minimized(self, bucket, code):
+        '''Keep a minimized input of bucket next to its exemplars'''
+        with open(os.path.join(self.directory, bucket, 'minimized.php'), 'w') as f:
+            f.write(str(code))
+
+    def buckets(self):
+        '''(bucket, number of hits) for every bucket in the directory, most hit first'''
+        result = []
+        for bucket in os.listdir(self.directory):
+            try:
+                hits = os.path.getsize(os.path.join(self.directory, bucket, 'hits'))
+            except OSError:
+                continue
+            result.append((bucket, hits))
+        return sorted(result, key=lambda item: item[1], reverse=True)
+
+    def summary(self):
+        buckets = self.buckets()
+        lines = [f"{len(buckets)} crash signatures in {self.directory}"]
+        for bucket, hits in buckets:
+            lines.append(f"  {bucket:<40} {hits}")
+        return "\n".join(lines)
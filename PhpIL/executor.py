@@ -1,8 +1,14 @@
 import os
 import sys
 import json
+import struct
+import select
+import signal
+import asyncio
 import logging
 import tempfile
+import threading
+import subprocess
 from collections import defaultdict
 
 import pwnlib
@@ -10,81 +16,375 @@ import pwnlib
 logger = logging.getLogger('Executor')
 #logging.getLogger('pwnlib.tubes.process.process').setLevel(logging.DEBUG)
 
+# 0 means everything is fine
+# -1/255 means syntax error
+# -25 means some php fatal errors, not interesting for us
+BORING_EXIT_CODES = {0, 255, -1, -25}
+
+REPRL_HARNESS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils', 'reprl.php')
+# directory for the input file when memfd_create is not available, tmpfs when there is one
+INPUT_DIR = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+
+def _drain(fd, chunks):
+    '''Read fd into chunks until the end of file and close it'''
+    try:
+        while True:
+            data = os.read(fd, 0x10000)
+            if data == b'':
+                return
+            chunks.append(data)
+    finally:
+        os.close(fd)
+
+class InputFile:
+    '''
+    The file php reads the inputs from. One file is reused for all inputs and
+    rewritten in place. It is an anonymous memory file (memfd_create), which
+    php opens through /proc/<pid>/fd/<fd>, or a file in INPUT_DIR where that
+    is not available.
+    '''
+    def __init__(self, directory=INPUT_DIR):
+        self._tmp_path = None
+        fd = None
+        if hasattr(os, 'memfd_create'):
+            try:
+                fd = os.memfd_create('phpil_input', 0)
+                self.path = f'/proc/{os.getpid()}/fd/{fd}'
+            except OSError as e:
+                logger.warning("memfd_create failed, using a file in %s: %r" % (directory, e))
+                fd = None
+        if fd is None:
+            fd, self._tmp_path = tempfile.mkstemp(suffix='.php', dir=directory)
+            self.path = self._tmp_path
+        self._file = os.fdopen(fd, 'w+')
+
+    def write(self, code):
+        '''Replace the content of the file with code, a string or an object with write_to'''
+        self._file.seek(0)
+        if isinstance(code, str):
+            self._file.write(code)
+        else:
+            code.write_to(self._file)
+        self._file.truncate()
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        if self._tmp_path is not None:
+            os.unlink(self._tmp_path)
+            self._tmp_path = None
+
 class Executor:
     '''
     This class takes care of executing the target binary with the inputs
     '''
-    def __init__(self, binary, output_dir, cmdline_flags=None, code=None, is_stdin=False, extra_args=None):
+    def __init__(self, binary, output_dir, cmdline_flags=None, code=None, is_stdin=False, extra_args=None, persistent=False, timeout=5, env=None,
+                 coverage_dir='/tmp/coverages', crash_handler=None):
         '''
         @param binary:          The path to the binary
         @param output_dir:      The directory to store the outputs and inputs in
         @param cmdline_flags:   The command line flags to the binary
-        @param code:            The fuzzer generated program
+        @param code:            The fuzzer generated program, either a string or an object with a
+                                write_to(fileobj) method like codeEmitter.CodeEmitter
                                 Code can be none so that this object can be re-used for other inputs.
         @param is_stdin:        Whether the input is to be read via stdin or not
         @param extra_args:      Any args that might be required after the filename
+        @param persistent:      Run the inputs in forked children of one long running binary
+                                (see utils/reprl.php) instead of starting the binary for each input
+        @param timeout:         The number of seconds an input is allowed to run
+        @param env:             Extra environment variables for the binary
+        @param coverage_dir:    The directory ASAN writes the .sancov files to
+        @param crash_handler:   Called with (exit_code, input, output, stderr) for every crash instead of
+                                keeping the crash in memory, e.g. crash_triage.CrashStore.add
         '''
         self._program_path = binary
-        self._program_args = cmdline_flags
+        self._program_args = [] if cmdline_flags is None else cmdline_flags
         self._output_dir = output_dir
         self._extra_args = [] if extra_args is None else extra_args
         self._is_stdin = is_stdin
+        self._persistent = persistent
+        self._timeout = timeout
+        self._env = {} if env is None else env
+        self._coverage_dir = coverage_dir
+        self._crash_handler = crash_handler
         self._non_zero_exits = defaultdict(list)
+        self._server = None
+        self._input_file = None
         self.code = code
         self.crash_num = 0
     
-    def execute(self, collect_stderr=False, save_input=False):
+    def execute(self, collect_stderr=False, save_input=False, record=True):
+        '''
+        Run self.code and return (output, err, exit_code). err is the stderr of
+        the binary if collect_stderr is set, otherwise stderr is part of the
+        output and err is empty. Crashes are recorded unless record is False,
+        for callers that decide themselves what to record.
+        '''
         logger.info("Executing %s" % self._program_path)
-        assert collect_stderr is False, "Not Implemented!"
         assert self.code is not None, "There is no code to run!"
+        # written before the run, so that the input is there even if the binary hangs or we are killed
         if save_input is True:
-            with open(f'{self._output_dir}/saved_input.php', 'w') as f:
-                f.write(self.code)
+            self._save_input()
+
+        output, err, exit_code = self._run(collect_stderr)
+        if record:
+            self._record_exit(exit_code, output, err=err)
+        return output, err, exit_code
+
+    def _run(self, collect_stderr=False):
+        # handle persistent mode
+        if self._persistent:
+            if self._server is not None or self._spawn_server():
+                logger.info("Running in the persistent harness")
+                return self._execute_persistent(collect_stderr)
+            logger.warning("Persistent harness is not available, falling back to a process per input")
+            self._persistent = False
 
         # handle stdin cases
         if self._is_stdin:
             logger.info("Running with stdin")
-            return self._execute()
+            return self._execute(collect_stderr=collect_stderr)
 
         # handle non stdin cases
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.php') as fp:
-            fp.write(self.code)
-            fp.seek(0)
-            fp.flush()
-            logger.info("Running with payload in temporary file %s" % fp.name)
-            return self._execute(filename=fp.name)
+        if self._input_file is None:
+            self._input_file = InputFile()
+        self._input_file.write(self.code)
+        logger.info("Running with payload in %s" % self._input_file.path)
+        return self._execute(filename=self._input_file.path, collect_stderr=collect_stderr)
     
+    def execute_batch(self, batch, collect_stderr=False):
+        '''
+        Run the programs of a lifter.BatchLifter in as few processes as
+        possible and return an (output, exit_code) pair for every program.
+
+        A program that ends the process without crashing it (timeout, fatal
+        error) gets the exit code of the process and the programs after it run
+        in a new batch. A batch that ends before any of its programs starts,
+        usually because one of them does not compile, is bisected until that
+        program runs on its own. When a batch crashes, the program that was running is
+        tried on its own first. If that does not crash, the batch is bisected
+        until the crash is pinned to one program. The crashing program is
+        recorded like a crash of execute(). A crash that only happens when
+        several programs run together is recorded with the code of all of them.
+        '''
+        results = [None] * len(batch)
+        self._execute_batch(batch, list(range(len(batch))), results, collect_stderr)
+        return results
+
+    def _execute_batch(self, batch, indices, results, collect_stderr):
+        while len(indices) > 0:
+            sub = batch.subset(indices)
+            self.code = sub
+            output, err, exit_code = self.execute(collect_stderr=collect_stderr, record=False)
+            outputs = sub.splitOutput(output, exit_code)
+
+            if exit_code not in BORING_EXIT_CODES:
+                if len(indices) == 1:
+                    results[indices[0]] = outputs[0] or (output, exit_code)
+                    self._record_exit(exit_code, output, err=err)
+                    return
+                # most likely the program that was running crashes on its own
+                running = [pos for pos, result in enumerate(outputs) if result is not None and result[1] == exit_code]
+                if len(running) > 0:
+                    pos = running[0]
+                    crashes = self.crash_num
+                    self._execute_batch(batch, [indices[pos]], results, collect_stderr)
+                    if self.crash_num > crashes:
+                        for idx, result in zip(indices[:pos], outputs[:pos]):
+                            results[idx] = result
+                        indices = indices[pos+1:]
+                        continue
+
+                logger.info("Batch of %d programs crashed, bisecting it" % len(indices))
+                crashes = self.crash_num
+                half = len(indices) // 2
+                self._execute_batch(batch, indices[:half], results, collect_stderr)
+                self._execute_batch(batch, indices[half:], results, collect_stderr)
+                if self.crash_num == crashes:
+                    self.code = sub
+                    self._record_exit(exit_code, output, err=err)
+                return
+
+            remaining = [idx for idx, result in zip(indices, outputs) if result is None]
+            for idx, result in zip(indices, outputs):
+                if result is not None:
+                    results[idx] = result
+            if len(remaining) == len(indices):
+                if len(indices) == 1:
+                    results[indices[0]] = (output, exit_code)
+                    return
+                # not even the first program started, most likely one of them does not compile
+                logger.info("Batch of %d programs did not start, bisecting it" % len(indices))
+                half = len(indices) // 2
+                self._execute_batch(batch, indices[:half], results, collect_stderr)
+                self._execute_batch(batch, indices[half:], results, collect_stderr)
+                return
+            indices = remaining
+
     def dump_inputs(self, filename='fuzzer_inputs.json'):
         with open(os.path.join(self._output_dir, filename), 'w') as f:
             json.dump(self._non_zero_exits, f, indent=2)
 
-    def _execute(self, filename=None):
+    def _save_input(self):
+        data = str(self.code).encode('utf-8')
+        fd = os.open(f'{self._output_dir}/saved_input.php', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        '''
+        Stop the persistent harness if one is running and release the input file
+        '''
+        if self._input_file is not None:
+            self._input_file.close()
+            self._input_file = None
+        self._stop_server()
+
+    def _stop_server(self):
+        if self._server is None:
+            return
+        os.close(self._ctrl_fd)
+        os.close(self._status_fd)
+        self._server.kill()
+        self._server.wait()
+        self._server.stdout.close()
+        self._server.stderr.close()
+        self._server = None
+
+    def _execute(self, filename=None, collect_stderr=False):
         output, err, exit_code = b'', b'', 255
 
         cmd = self._build_command(filename=filename)
 
-        env = os.environ.copy()
-        env["ASAN_OPTIONS"] = "coverage=1:coverage_dir=/tmp/coverages/"
-        r = pwnlib.tubes.process.process(cmd, env=env)
-        r.wait(timeout=5)
+        stderr = subprocess.PIPE if collect_stderr else subprocess.STDOUT
+        r = pwnlib.tubes.process.process(cmd, env=self._build_env(), stderr=stderr)
+        # stderr is read while php runs, a sanitizer report bigger than the pipe would block it
+        err_chunks = []
+        if collect_stderr:
+            reader = threading.Thread(target=_drain, args=(os.dup(r.proc.stderr.fileno()), err_chunks), daemon=True)
+            reader.start()
+        if self._is_stdin:
+            r.send(str(self.code).encode('utf-8'))
+            r.shutdown('send')
+        r.wait(timeout=self._timeout)
         exit_code = r.poll()
         if exit_code is None:
             r.kill()
             exit_code = 255
         output = r.recvall(timeout=1).strip().decode('utf-8')
         logger.info("Received %d bytes of output" % len(output))
+        if collect_stderr:
+            # a child of php can keep the pipe open, do not wait for it
+            reader.join(timeout=1)
+            err = b''.join(err_chunks).decode('utf-8', errors='replace')
         
         logger.info("Process exited with exit code %d", exit_code)
+
+        return output, err, exit_code
+
+    def _execute_persistent(self, collect_stderr=False):
+        output, err, exit_code = b'', b'', 255
+
+        code = str(self.code).encode('utf-8')
+        try:
+            os.write(self._ctrl_fd, struct.pack('<4sII', b'exec', int(self._timeout * 1000), len(code)) + code)
+        except BrokenPipeError:
+            logger.warning("Persistent harness went away, restarting it")
+            self._stop_server()
+            return output, err, exit_code
+
+        chunks = []
+        err_chunks = []
+        status = b''
+        stdout_fd = self._server.stdout.fileno()
+        stderr_fd = self._server.stderr.fileno()
+        # the harness enforces the timeout itself, this is only a safety net
+        deadline = self._timeout + 5
+        while len(status) < 4:
+            readable, _, _ = select.select([stdout_fd, stderr_fd, self._status_fd], [], [], deadline)
+            if not readable:
+                logger.warning("Persistent harness is not responding, restarting it")
+                self._stop_server()
+                return output, err, exit_code
+            if stdout_fd in readable:
+                chunks.append(os.read(stdout_fd, 0x10000))
+            if stderr_fd in readable:
+                err_chunks.append(os.read(stderr_fd, 0x10000))
+            if self._status_fd in readable:
+                data = os.read(self._status_fd, 4 - len(status))
+                if data == b'':
+                    logger.warning("Persistent harness exited, restarting it")
+                    self._stop_server()
+                    return output, err, exit_code
+                status += data
+
+        # the child has exited so everything it wrote is already in the pipes
+        for fd, fd_chunks in ((stdout_fd, chunks), (stderr_fd, err_chunks)):
+            while True:
+                try:
+                    data = os.read(fd, 0x10000)
+                except BlockingIOError:
+                    break
+                if data == b'':
+                    break
+                fd_chunks.append(data)
+
+        exit_code = struct.unpack('<i', status)[0]
+        if collect_stderr:
+            err = b''.join(err_chunks).decode('utf-8', errors='replace')
+        else:
+            chunks += err_chunks
+        output = b''.join(chunks).strip().decode('utf-8', errors='replace')
+        logger.info("Received %d bytes of output" % len(output))
+
+        logger.info("Process exited with exit code %d", exit_code)
+
+        return output, err, exit_code
+
+    def _spawn_server(self):
+        ctrl_r, ctrl_w = os.pipe()
+        status_r, status_w = os.pipe()
+        cmd = [f'{self._program_path}'] + self._program_args + [REPRL_HARNESS, f'{ctrl_r}', f'{status_w}']
+        logger.info("Starting persistent harness %s" % REPRL_HARNESS)
+        self._server = subprocess.Popen(cmd, env=self._build_env(), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, pass_fds=(ctrl_r, status_w))
+        os.close(ctrl_r)
+        os.close(status_w)
+        os.set_blocking(self._server.stdout.fileno(), False)
+        os.set_blocking(self._server.stderr.fileno(), False)
+        self._ctrl_fd = ctrl_w
+        self._status_fd = status_r
+
+        readable, _, _ = select.select([status_r], [], [], self._timeout)
+        if readable and os.read(status_r, 4) == b'HELO':
+            return True
+
+        self._stop_server()
+        return False
+
+    def _record_exit(self, exit_code, output, code=None, err=None):
         # we only record weird exit_code
-        # 0 means everything is fine
-        # -1/255 means syntax error
-        # -25 means some php fatal errors, not interesting for us
-        if exit_code not in {0, 255, -1, -25}:
+        if exit_code not in BORING_EXIT_CODES:
             logger.info("Logging code with exit_code: %d", exit_code)
-            self._non_zero_exits[exit_code].append({'input': self.code, 'output': output})
+            code = str(self.code if code is None else code)
+            if isinstance(err, bytes):
+                err = err.decode('utf-8', errors='replace')
+            if self._crash_handler is not None:
+                self._crash_handler(exit_code, code, output, err)
+            else:
+                crash = {'input': code, 'output': output}
+                if err:
+                    crash['stderr'] = err
+                self._non_zero_exits[exit_code].append(crash)
             self.crash_num += 1
 
-        return output, err, exit_code
+    def _build_env(self):
+        env = os.environ.copy()
+        env["ASAN_OPTIONS"] = f"coverage=1:coverage_dir={self._coverage_dir}/"
+        env.update(self._env)
+        return env
 
     def _build_command(self, filename=None):
         if self._is_stdin:
@@ -93,3 +393,92 @@ class Executor:
         assert filename is not None, "File name is required when input is not from stdin"
         return [f'{self._program_path}'] + self._program_args + [f'{filename}'] + self._extra_args
         
+
+
+class AsyncExecutor(Executor):
+    '''
+    Runs up to concurrency inputs at the same time, each in its own php
+    process, so that the caller can generate and lift the next programs while
+    php runs. There is no persistent harness, every input starts php.
+    '''
+    def __init__(self, *args, concurrency=4, **kwargs):
+        '''
+        @param concurrency:     The number of php processes running at the same time
+        The other parameters are the ones of Executor, persistent is ignored.
+        '''
+        super().__init__(*args, **kwargs)
+        self._persistent = False
+        self.concurrency = concurrency
+        self._slots = None
+        # input files of the runs that are not in flight, reused by the next runs
+        self._free_files = []
+
+    async def execute_async(self, code, record=True, collect_stderr=False):
+        '''
+        Run code once a slot is free and return (output, err, exit_code, pid). The pid
+        tells the caller which .sancov file belongs to this run.
+        '''
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        async with self._slots:
+            if self._is_stdin:
+                output, err, exit_code, pid = await self._execute_async(None, str(code).encode('utf-8'), collect_stderr)
+            else:
+                input_file = self._free_files.pop() if len(self._free_files) > 0 else InputFile()
+                try:
+                    input_file.write(code)
+                    output, err, exit_code, pid = await self._execute_async(input_file.path, None, collect_stderr)
+                finally:
+                    self._free_files.append(input_file)
+
+        if record:
+            self._record_exit(exit_code, output, code, err)
+        return output, err, exit_code, pid
+
+    async def _execute_async(self, filename, stdin_data, collect_stderr):
+        output, err, exit_code = b'', b'', 255
+
+        cmd = self._build_command(filename=filename)
+        proc = await asyncio.create_subprocess_exec(*cmd, env=self._build_env(),
+                                                    stdin=subprocess.DEVNULL if stdin_data is None else subprocess.PIPE,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.PIPE if collect_stderr else subprocess.STDOUT,
+                                                    start_new_session=True)
+        # wait_for can swallow a cancellation that comes in when the process exits, a timer that
+        # kills the process does not get in the way of cancelling
+        timed_out = []
+        timer = asyncio.get_running_loop().call_later(self._timeout, self._kill, proc, timed_out)
+        try:
+            stdout, stderr = await proc.communicate(stdin_data)
+        except asyncio.CancelledError:
+            self._kill(proc)
+            # reap it and close the pipes while the loop is still running
+            await proc.communicate()
+            raise
+        finally:
+            timer.cancel()
+        exit_code = 255 if timed_out else proc.returncode
+        output = stdout.strip().decode('utf-8', errors='replace')
+        logger.info("Received %d bytes of output" % len(output))
+        if collect_stderr:
+            err = stderr.decode('utf-8', errors='replace')
+
+        logger.info("Process %d exited with exit code %d", proc.pid, exit_code)
+
+        return output, err, exit_code, proc.pid
+
+    @staticmethod
+    def _kill(proc, killed=None):
+        # the whole session, children of php would keep stdout open
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return
+        if killed is not None:
+            killed.append(proc.pid)
+
+    def close(self):
+        super().close()
+        for input_file in self._free_files:
+            input_file.close()
+        self._free_files = []
@@ -0,0 +1,107 @@
+import logging
+from collections import defaultdict
+
+from . import probability
+
+logger = logging.getLogger('GeneratorStats')
+
+class GeneratorStats:
+    '''
+    What every code generator yields: how often it runs and fails, how many
+    instructions it emits itself (not counting the generateRandomInst calls
+    it makes) and how many new edges the programs it contributed to found.
+
+    adapt() turns this into new weights for a dict of code generators like
+    Settings.allCodeGenerators, bandit style: the weight a generator starts
+    with is scaled by its success rate and by how its programs do compared
+    to the average program, and a share of the original weight is always
+    kept so that no generator is starved for good.
+    '''
+    def __init__(self, exploration=0.1, maxScale=8.0):
+        '''
+        @param exploration:     The share of the original weight every generator keeps
+        @param maxScale:        Bound on how much better or worse than average a generator can be rated
+        '''
+        self.enabled = False
+        self.exploration = exploration
+        self.maxScale = maxScale
+        self.initialWeights = {}
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        self.runs = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.instructions = defaultdict(int)
+        self.programs = defaultdict(int)
+        self.edges = defaultdict(int)
+        self.totalPrograms = 0
+        self.totalEdges = 0
+        # generators that ran since the last reward
+        self.current = set()
+
+    def record(self, generator, success, numInstructions):
+        self.runs[generator] += 1
+        if not success:
+            self.failures[generator] += 1
+        self.instructions[generator] += numInstructions
+        if numInstructions > 0:
+            self.current.add(generator)
+
+    def take(self):
+        '''The generators that ran since the last reward or take, for programs that are rewarded later'''
+        generators = self.current
+        self.current = set()
+        return generators
+
+    def reward(self, newEdges, generators=None):
+        '''
+        Credit the generators of a program with the new edges it found. These are the
+        generators that ran since the last call unless the ones taken for it are given
+        '''
+        if generators is None:
+            generators = self.take()
+        for generator in generators:
+            self.programs[generator] += 1
+            self.edges[generator] += newEdges
+        self.totalPrograms += 1
+        self.totalEdges += newEdges
+
+    def score(self, generator):
+        '''How much the weight of generator should be scaled'''
+        runs = self.runs[generator]
+        successRate = (runs - self.failures[generator] + 1) / (runs + 2)
+
+        # edges per program, smoothed towards the average so that rarely used generators are not judged by a few runs
+        average = (self.totalEdges + 1) / (self.totalPrograms + 1)
+        yieldRate = (self.edges[generator] + average) / (self.programs[generator] + 1)
+        ratio = min(max(yieldRate / average, 1 / self.maxScale), self.maxScale)
+
+        return (1 - self.exploration) * successRate * ratio + self.exploration
+
+    def adapt(self, weights):
+        '''Reweight the generators of weights in place, generators with weight 0 stay disabled'''
+        for generator, weight in weights.items():
+            self.initialWeights.setdefault(generator, weight)
+        for generator in weights:
+            initial = self.initialWeights[generator]
+            if initial > 0:
+                weights[generator] = initial * self.score(generator)
+        probability.Random.weightsChanged(weights)
+        logger.debug("New code generator weights: %s" % {g.__name__: round(w, 2) for g, w in weights.items()})
+
+    def snapshot(self):
+        return {
+            generator.__name__: {
+                'runs': self.runs[generator],
+                'failures': self.failures[generator],
+                'instructions': self.instructions[generator],
+                'programs': self.programs[generator],
+                'edges': self.edges[generator],
+            } for generator in self.runs
+        }
+
+# the generator stats of this process
+tracker = GeneratorStats()
@@ -3,6 +3,7 @@ from . import variable
 from .opcode import Opcode
 
 class Instruction:
+    __slots__ = ('operation', 'inputs', 'outputs', 'temp')
 
     def __init__(self, operation, inputs=False, outputs=False, temp=False):
         self.operation = operation
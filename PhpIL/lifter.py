@@ -1,3 +1,7 @@
+import io
+import re
+import time
+
 from . import program
 from . import codeEmitter
 from . import instructions
@@ -5,13 +9,16 @@ from . import probability
 from . import operation
 from . import variable
 from . import typesData
+from . import stats
 from .opcode import Opcode
 
 class Lifter:
 
-    def __init__(self, prog):
+    def __init__(self, prog, emitter=None, tracker=None):
         self.program = prog
-        self.emitter = codeEmitter.CodeEmitter()
+        self.emitter = codeEmitter.CodeEmitter() if emitter is None else emitter
+        # the stats.Stats the lift times go to, the one of the process by default
+        self.tracker = stats.tracker if tracker is None else tracker
         self._prefix = None
 
     def emit(self, text):
@@ -32,237 +39,352 @@ class Lifter:
         opcode = inst.getOpcode()
 
         # only process prefix for certain operations
-        if self._prefix and inst.operation.opcode not in [Opcode.CallFunction, Opcode.UnaryOperation, Opcode.BinaryOperation]:
+        if self._prefix and opcode not in Lifter.prefixable:
             self._prefix = None
 
-        if opcode == Opcode.LoadInteger or \
-            opcode == Opcode.LoadFloat or \
-            opcode == Opcode.LoadBoolean:
-
-            self.emitline(str(inst.getOutput()) + " = " + str(inst.operation.value))
-
-        if opcode == Opcode.LoadString:
-            self.emitline(str(inst.getOutput()) + " = \"" + str(inst.operation.value)+"\"")
-
-        if opcode == Opcode.Nop:
-            pass
-
-        if opcode == Opcode.BeginFunction:
-            output = inst.getOutput()
-            signature = inst.operation.signature
-            args = inst.getAllTemps()
-
-            code = str(output) + " = function( "
-            code += ", ".join([str(x) for x in args])
-            code += ") "
-
-            outerVars = signature.getOuterVars()
-            # print outerVars
-            if len(outerVars) > 0:
-                code += "use ("
-                for var in outerVars:
-                    code += str(var)+", "
-                if code[-2:] == ', ':
-                    code = code[:-2]
-                code += " ){"
-            else:
-                code += "{"
-
-            self.emit(code)
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.EndFunction:
-            self.emitter.decreaseIndentLevel()
-            self.emitline("}")
-
+        handler = Lifter.handlers.get(opcode)
+        if handler is None:
+            return
+
+        if not self.tracker.enabled:
+            handler(self, inst)
+            return
+
+        start = time.perf_counter()
+        handler(self, inst)
+        self.tracker.addTime("lift." + opcode.name, time.perf_counter() - start)
+
+    '''Make func(lifter, inst) lift the instructions with the given opcode'''
+    @classmethod
+    def register(cls, opcode, func):
+        cls.handlers[opcode] = func
+
+    '''Handlers for every opcode start'''
+
+    def liftLiteral(self, inst):
+        self.emitline(str(inst.getOutput()) + " = " + str(inst.operation.value))
+
+    def liftLoadString(self, inst):
+        self.emitline(str(inst.getOutput()) + " = \"" + str(inst.operation.value)+"\"")
+
+    def liftNop(self, inst):
+        pass
+
+    def liftBeginFunction(self, inst):
+        output = inst.getOutput()
+        signature = inst.operation.signature
+        args = inst.getAllTemps()
+
+        code = str(output) + " = function( "
+        code += ", ".join([str(x) for x in args])
+        code += ") "
+
+        outerVars = signature.getOuterVars()
+        # print outerVars
+        if len(outerVars) > 0:
+            code += "use ("
+            for var in outerVars:
+                code += str(var)+", "
+            if code[-2:] == ', ':
+                code = code[:-2]
+            code += " ){"
+        else:
+            code += "{"
+
+        self.emit(code)
+        self.emitter.increaseIndentLevel()
+
+    def liftEndFunction(self, inst):
+        self.emitter.decreaseIndentLevel()
+        self.emitline("}")
+
+    def liftCallFunction(self, inst):
+        output = str(inst.getOutput())
+        func = inst.getInput()
+
+        inp_code = str(func)+"( "
+        inp_code += ", ".join([str(x) for x in inst.getAllInputs()[1:]])
+        inp_code += ")"
+        if self._prefix:
+            inp_code = f"{self._prefix}.({inp_code})"
+            self._prefix = None
+        code = f"{output} = {inp_code}"
+
+        self.emitline(code)
+
+    def liftLoadNull(self, inst):
+        self.emitline(str(inst.getOutput()) + " = null")
+
+    def liftReturn(self, inst):
+        self.emitline("return " + str(inst.getInput()))
+
+    def liftBeginIf(self, inst):
+        self.emit("if(" + str(inst.getInput(0)) + "){")
+        self.emitter.increaseIndentLevel()
+
+    def liftBeginElse(self, inst):
+        self.emitter.decreaseIndentLevel()
+        self.emit("}else{")
+        self.emitter.increaseIndentLevel()
+
+    def liftBlockEnd(self, inst):
+        self.emitter.decreaseIndentLevel()
+        self.emit("}")
+
+    def liftBreak(self, inst):
+        self.emitline("break")
+
+    def liftContinue(self, inst):
+        self.emitline("continue")
+
+    def liftUnaryOperation(self, inst):
+        code = str(inst.getInput()) + " = "
+        altCode = str(inst.getOutput()) + " = "
+        commonCode = ""
+        op = inst.operation.op
+        if op == operation.UnaryOperator.Inc:
+            commonCode = str(inst.getInput())+ " + 1"
+        if op == operation.UnaryOperator.Dec:
+            commonCode = str(inst.getInput())+ " - 1"
+        if op == operation.UnaryOperator.BitwiseNot:
+            commonCode = str(inst.operation.op) + str(inst.getInput())
+        if op == operation.UnaryOperator.LogicalNot:
+            commonCode = str(inst.operation.op) + str(inst.getInput())
+
+        if self._prefix:
+            commonCode = f"{self._prefix}.({commonCode})"
+        code += commonCode
+        altCode += commonCode
+        self.emitline(code)
+        self.emitline(altCode)
+        self._prefix = None
 
-        if opcode == Opcode.CallFunction:
-            output = str(inst.getOutput())
-            func = inst.getInput()
+    def liftBinaryOperation(self, inst):
+        out = str(inst.getOutput())
+        inp1 = str(inst.getInput(0))
+        inp2 = str(inst.getInput(1))
 
-            inp_code = str(func)+"( "
-            inp_code += ", ".join([str(x) for x in inst.getAllInputs()[1:]])
-            inp_code += ")"
+        op = inst.operation.op
+        if(op == operation.BinaryOperator.LShift or op == operation.BinaryOperator.RShift):
+            code = inp1 + str(inst.operation.op) + inp2
             if self._prefix:
-                inp_code = f"{self._prefix}.({inp_code})"
+                code = f"{self._prefix}.({code})"
                 self._prefix = None
-            code = f"{output} = {inp_code}"
-
-            self.emitline(code)
-
-        if opcode == Opcode.LoadNull:
-            self.emitline(str(inst.getOutput()) + " = null")
-
-        if opcode == Opcode.Return:
-            self.emitline("return " + str(inst.getInput()))
-
-        if opcode == Opcode.BeginIf:
-            self.emit("if(" + str(inst.getInput(0)) + "){")
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.BeginElse:
-            self.emitter.decreaseIndentLevel()
-            self.emit("}else{")
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.EndIf:
-            self.emitter.decreaseIndentLevel()
-            self.emit("}")
-
-        if opcode == Opcode.Break:
-            self.emitline("break")
-
-        if opcode == Opcode.Continue:
-            self.emitline("continue")
-
-        if opcode == Opcode.UnaryOperation:
-            code = str(inst.getInput()) + " = "
-            altCode = str(inst.getOutput()) + " = "
-            commonCode = ""
-            op = inst.operation.op
-            if op == operation.UnaryOperator.Inc:
-                commonCode = str(inst.getInput())+ " + 1"
-            if op == operation.UnaryOperator.Dec:
-                commonCode = str(inst.getInput())+ " - 1"
-            if op == operation.UnaryOperator.BitwiseNot:
-                commonCode = str(inst.operation.op) + str(inst.getInput())
-            if op == operation.UnaryOperator.LogicalNot:
-                commonCode = str(inst.operation.op) + str(inst.getInput())
-
+            code = "if("+inp2+">0){"+ out + " = " + code + ";" +"}"
+            self.emit(code)
+        else:
+            code = inp1 + str(inst.operation.op) + inp2
             if self._prefix:
-                commonCode = f"{self._prefix}.({commonCode})"
-            code += commonCode
-            altCode += commonCode
-            self.emitline(code)
-            self.emitline(altCode)
-            self._prefix = None
+                code = f"{self._prefix}.({code})"
+            self.emitline(out+" = " + code)
 
-        if opcode == Opcode.BinaryOperation:
-            out = str(inst.getOutput())
-            inp1 = str(inst.getInput(0))
-            inp2 = str(inst.getInput(1))
-
-            op = inst.operation.op
-            if(op == operation.BinaryOperator.LShift or op == operation.BinaryOperator.RShift):
-                code = inp1 + str(inst.operation.op) + inp2
-                if self._prefix:
-                    code = f"{self._prefix}.({code})"
-                    self._prefix = None
-                code = "if("+inp2+">0){"+ out + " = " + code + ";" +"}"
-                self.emit(code)
-            else:
-                code = inp1 + str(inst.operation.op) + inp2
-                if self._prefix:
-                    code = f"{self._prefix}.({code})"
-                self.emitline(out+" = " + code)
+        self._prefix = None
 
-            self._prefix = None
+    def liftBeginFor(self, inst):
+        loopvar = inst.getTemp()
+        start = inst.getInput(0)
+        end = inst.getInput(1)
+        step = inst.getInput(2)
+
+        code = "for("
+        code += str(loopvar) + " = " + str(start) + "; "
+        code += str(loopvar) + " < " + str(end) + " ; "
+        code += str(loopvar) + " = " + str(loopvar) + " + " + str(step)
+
+        self.emit(code + "){")
+        self.emitter.increaseIndentLevel()
+
+    def liftBeginWhile(self, inst):
+        inp = str(inst.getInput(0)) + str(inst.operation.comparater) + str(inst.getInput(1))
+        self.emit("while (" + inp + "){")
+        self.emitter.increaseIndentLevel()
+
+    def liftBeginDoWhile(self, inst):
+        self.emit("do{")
+        self.emitter.increaseIndentLevel()
+
+    def liftEndDoWhile(self, inst):
+        self.emitter.decreaseIndentLevel()
+        inp = str(inst.getInput(0)) + str(inst.operation.comparater) + str(inst.getInput(1))
+        self.emitline("}while(" + inp + ")")
+
+    def liftInclude(self, inst):
+        self.emitline("include "+str(inst.getInput()))
+
+    def liftCopy(self, inst):
+        inp1 = str(inst.getInput(0))
+        inp2 = str(inst.getInput(1))
+        self.emitline(inp1 + " = " + inp2)
+
+    def liftPhi(self, inst):
+        out = str(inst.getOutput())
+        inp = str(inst.getInput())
+        self.emitline(out + " = " + inp)
+
+    def liftBeginTry(self, inst):
+        self.emit("try{")
+        self.emitter.increaseIndentLevel()
+
+    def liftBeginCatch(self, inst):
+        self.emitter.decreaseIndentLevel()
+        self.emit("}catch(Exception $e){")
+        self.emitter.increaseIndentLevel()
+
+    def liftCreateArray(self, inst):
+        code = str(inst.getOutput()) + " = "
+        if probability.Random.probability(0.5):
+            code += "[" + ", ".join([str(x) for x in inst.getAllInputs()]) + "]"
+        else:
+            code += "Array (" + ", ".join([str(x) for x in inst.getAllInputs()]) + ")"
+
+        self.emitline(code)
+
+    def liftCreateDict(self, inst):
+        code = str(inst.getOutput()) + " = "
+        if probability.Random.probability(0.5):
+            code += "["
+            for key, value in inst.getAllInputs():
+                code += str(key) + " => " + str(value) + ", "
+            if code[-2:] == ", ":
+                code = code[:-2]
+            code += "]"
+        else:
+            code += "Array("
+            for key, value in inst.getAllInputs():
+                code += str(key) + " => " + str(value) + ", "
+            if code[-2:] == ", ":
+                code = code[:-2]
+            code += ")"
+
+        self.emitline(code)
+
+    def liftGetArrayElem(self, inst):
+        code = str(inst.getOutput()) + " = "
+        code += str(inst.getInput(0)) + "[" + str(inst.getInput(1)) + "]"
+        self.emitline(code)
+
+    def liftSetArrayElem(self, inst):
+        code = str(inst.getInput(0)) + "[" + str(inst.getInput(1)) + "]"
+        code += " = " + str(inst.getInput(2))
+        self.emitline(code)
+
+    def liftVarPrefix(self, inst):
+        self._prefix = inst.inputs[0]
+
+    '''Handlers for every opcode end'''
+
+# opcodes that consume the prefix set by a VarPrefix, any other opcode drops it
+Lifter.prefixable = frozenset([Opcode.CallFunction, Opcode.UnaryOperation, Opcode.BinaryOperation])
+
+Lifter.handlers = {
+    Opcode.LoadInteger: Lifter.liftLiteral,
+    Opcode.LoadFloat: Lifter.liftLiteral,
+    Opcode.LoadBoolean: Lifter.liftLiteral,
+    Opcode.LoadString: Lifter.liftLoadString,
+    Opcode.Nop: Lifter.liftNop,
+    Opcode.BeginFunction: Lifter.liftBeginFunction,
+    Opcode.EndFunction: Lifter.liftEndFunction,
+    Opcode.CallFunction: Lifter.liftCallFunction,
+    Opcode.LoadNull: Lifter.liftLoadNull,
+    Opcode.Return: Lifter.liftReturn,
+    Opcode.BeginIf: Lifter.liftBeginIf,
+    Opcode.BeginElse: Lifter.liftBeginElse,
+    Opcode.EndIf: Lifter.liftBlockEnd,
+    Opcode.Break: Lifter.liftBreak,
+    Opcode.Continue: Lifter.liftContinue,
+    Opcode.UnaryOperation: Lifter.liftUnaryOperation,
+    Opcode.BinaryOperation: Lifter.liftBinaryOperation,
+    Opcode.BeginFor: Lifter.liftBeginFor,
+    Opcode.EndFor: Lifter.liftBlockEnd,
+    Opcode.BeginWhile: Lifter.liftBeginWhile,
+    Opcode.EndWhile: Lifter.liftBlockEnd,
+    Opcode.BeginDoWhile: Lifter.liftBeginDoWhile,
+    Opcode.EndDoWhile: Lifter.liftEndDoWhile,
+    Opcode.Include: Lifter.liftInclude,
+    Opcode.Copy: Lifter.liftCopy,
+    Opcode.Phi: Lifter.liftPhi,
+    Opcode.BeginTry: Lifter.liftBeginTry,
+    Opcode.BeginCatch: Lifter.liftBeginCatch,
+    Opcode.EndTryCatch: Lifter.liftBlockEnd,
+    Opcode.CreateArray: Lifter.liftCreateArray,
+    Opcode.CreateDict: Lifter.liftCreateDict,
+    Opcode.GetArrayElem: Lifter.liftGetArrayElem,
+    Opcode.SetArrayElem: Lifter.liftSetArrayElem,
+    Opcode.VarPrefix: Lifter.liftVarPrefix,
+}
+
+class BatchLifter:
+
+    '''
+    Lifts several programs into one php file for Executor.execute_batch.
+    Every program runs in a function of its own so that their variables do
+    not clash, inside a try/catch so that an exception does not stop the
+    programs after it, and its output is enclosed in start and end markers.
+    Every program is lifted once, so a subset of the batch runs exactly the
+    same code.
+    '''
+    marker = "--PHPIL-BATCH-%s-%d--"
+    markerRegex = re.compile(r"--PHPIL-BATCH-(START|END)-(\d+)--")
+
+    def __init__(self, programs, lifted=None):
+        self.programs = list(programs)
+        # one emitter per program
+        self.lifted = lifted
+
+    def __len__(self):
+        return len(self.programs)
 
+    def doLifting(self):
+        self.lifted = []
+        for prog in self.programs:
+            emitter = codeEmitter.CodeEmitter()
+            emitter.increaseIndentLevel()
+            Lifter(prog, emitter).doLifting()
+            self.lifted.append(emitter)
+
+    '''A batch of the programs at the given positions'''
+    def subset(self, indices):
+        return BatchLifter([self.programs[i] for i in indices], [self.lifted[i] for i in indices])
+
+    def write_to(self, fileobj):
+        fileobj.write(codeEmitter.CodeEmitter.header)
+        for idx, emitter in enumerate(self.lifted):
+            fileobj.write("echo \"\\n" + self.marker % ("START", idx) + "\\n\";\n")
+            fileobj.write("function phpil_batch_%d(){\n" % idx)
+            fileobj.writelines(emitter.chunks)
+            fileobj.write("}\n")
+            fileobj.write("try{ phpil_batch_%d(); }catch(Throwable $e){}\n" % idx)
+            fileobj.write("echo \"\\n" + self.marker % ("END", idx) + "\\n\";\n")
+        fileobj.write(codeEmitter.CodeEmitter.footer)
 
-        if opcode == Opcode.BeginFor:
-            loopvar = inst.getTemp()
-            start = inst.getInput(0)
-            end = inst.getInput(1)
-            step = inst.getInput(2)
-
-            code = "for("
-            code += str(loopvar) + " = " + str(start) + "; "
-            code += str(loopvar) + " < " + str(end) + " ; "
-            code += str(loopvar) + " = " + str(loopvar) + " + " + str(step)
-
-            self.emit(code + "){")
-            self.emitter.increaseIndentLevel()
-
-
-        if opcode == Opcode.EndFor:
-            self.emitter.decreaseIndentLevel()
-            self.emit("}")
-
-        if opcode == Opcode.BeginWhile:
-            inp = str(inst.getInput(0)) + str(inst.operation.comparater) + str(inst.getInput(1))
-            self.emit("while (" + inp + "){")
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.EndWhile:
-            self.emitter.decreaseIndentLevel()
-            self.emit("}")
-
-        if opcode == Opcode.BeginDoWhile:
-            self.emit("do{")
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.EndDoWhile:
-            self.emitter.decreaseIndentLevel()
-            inp = str(inst.getInput(0)) + str(inst.operation.comparater) + str(inst.getInput(1))
-            self.emitline("}while(" + inp + ")")
-
-
-        if opcode == Opcode.Include:
-            self.emitline("include "+str(inst.getInput()))
-
-        if opcode == Opcode.Copy:
-            inp1 = str(inst.getInput(0))
-            inp2 = str(inst.getInput(1))
-            self.emitline(inp1 + " = " + inp2)
-
-        if opcode == Opcode.Phi:
-            out = str(inst.getOutput())
-            inp = str(inst.getInput())
-            self.emitline(out + " = " + inp)
-
-        if opcode == Opcode.BeginTry:
-            self.emit("try{")
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.BeginCatch:
-            self.emitter.decreaseIndentLevel()
-            self.emit("}catch(Exception $e){")
-            self.emitter.increaseIndentLevel()
-
-        if opcode == Opcode.EndTryCatch:
-            self.emitter.decreaseIndentLevel()
-            self.emit("}")
-
-        if opcode == Opcode.CreateArray:
-            code = str(inst.getOutput()) + " = "
-            if probability.Random.probability(0.5):
-                code += "[" + ", ".join([str(x) for x in inst.getAllInputs()]) + "]"
-            else:
-                code += "Array (" + ", ".join([str(x) for x in inst.getAllInputs()]) + ")"
-
-            self.emitline(code)
-
-        if opcode == Opcode.CreateDict:
-            code = str(inst.getOutput()) + " = "
-            if probability.Random.probability(0.5):
-                code += "["
-                for key, value in inst.getAllInputs():
-                    code += str(key) + " => " + str(value) + ", "
-                if code[-2:] == ", ":
-                    code = code[:-2]
-                code += "]"
-            else:
-                code += "Array("
-                for key, value in inst.getAllInputs():
-                    code += str(key) + " => " + str(value) + ", "
-                if code[-2:] == ", ":
-                    code = code[:-2]
-                code += ")"
-
-            self.emitline(code)
-
-        if opcode == Opcode.GetArrayElem:
-            code = str(inst.getOutput()) + " = "
-            code += str(inst.getInput(0)) + "[" + str(inst.getInput(1)) + "]"
-            self.emitline(code)
-
-        if opcode == Opcode.SetArrayElem:
-            code = str(inst.getInput(0)) + "[" + str(inst.getInput(1)) + "]"
-            code += " = " + str(inst.getInput(2))
-            self.emitline(code)
-
-        if opcode == Opcode.VarPrefix:
-            self._prefix = inst.inputs[0]
+    def getCode(self):
+        code = io.StringIO()
+        self.write_to(code)
+        return code.getvalue()
+
+    def __str__(self):
+        return self.getCode()
+
+    '''
+    Split the output of the batch into an (output, exit_code) pair per program.
+    Programs that finished get exit code 0, the program that was running when
+    the process exited gets its exit code and programs that never started get None.
+    '''
+    def splitOutput(self, output, exitCode):
+        results = [None] * len(self.programs)
+        running = None
+        start = 0
+        for match in self.markerRegex.finditer(output):
+            idx = int(match.group(2))
+            if match.group(1) == "START":
+                running = idx
+                start = match.end()
+            elif running == idx:
+                results[idx] = (output[start:match.start()].strip(), 0)
+                running = None
+        if running is not None:
+            results[running] = (output[start:].strip(), exitCode)
+        return results
 
 if __name__ == '__main__':
     def main():
@@ -0,0 +1,318 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import program
+from . import instructions
+from . import operation
+from . import typesData
+from . import variable
+from . import analyzer
+from . import lifter
+from . import executor
+from . import crash_triage
+from . import stats
+from .opcode import Opcode
+
+logger = logging.getLogger('Minimizer')
+
+class Node:
+    '''
+    A piece of a program the minimizer can remove: one instruction or a
+    block from its begin to its end. The else of an if and the catch of a
+    try are nodes of their own that run to the end of the block.
+    '''
+    def __init__(self, start, end, removable, children):
+        self.start = start
+        self.end = end
+        self.removable = removable
+        self.children = children
+
+class CrashTest:
+    '''
+    Whether a program crashes with the crash signature of bucket (see
+    crash_triage). The programs are lifted and run by an executor per
+    thread, created by executorFactory, so that tests can run in parallel.
+    The lifts are timed in a stats.Stats of their own, which is off, so the
+    tests do not touch the stats of the fuzzer from their threads.
+    '''
+    def __init__(self, executorFactory, bucket, numFrames=crash_triage.NUM_FRAMES):
+        self.executorFactory = executorFactory
+        self.bucket = bucket
+        self.numFrames = numFrames
+        self.stats = stats.Stats()
+        self._local = threading.local()
+        self._executors = []
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        runner = getattr(self._local, 'runner', None)
+        if runner is None:
+            runner = self.executorFactory()
+            self._local.runner = runner
+            with self._lock:
+                self._executors.append(runner)
+        return runner
+
+    def crashBucket(self, prog):
+        '''The crash bucket of prog, None if it does not crash'''
+        lift = lifter.Lifter(prog, tracker=self.stats)
+        lift.doLifting()
+        runner = self._executor()
+        runner.code = lift.emitter
+        output, err, exitCode = runner.execute(collect_stderr=True, record=False)
+        if exitCode in executor.BORING_EXIT_CODES:
+            return None
+        return crash_triage.crash_signature(exitCode, err, self.numFrames).bucket
+
+    def __call__(self, prog):
+        return self.crashBucket(prog) == self.bucket
+
+    def close(self):
+        for runner in self._executors:
+            runner.close()
+        self._executors = []
+
+class Minimizer:
+    '''
+    Shrinks a program while test(program) keeps returning True. This is
+    hierarchical delta debugging: the blocks and instructions at the top
+    level are removed in chunks first, then the ones inside the remaining
+    blocks and so on. Then the arguments of calls and the parameters of
+    functions are removed one at a time, and both steps are repeated until
+    nothing can be removed.
+
+    A candidate is only tested if every variable it uses is still defined
+    and, when the scope analyzer saw it in the original, still in scope.
+    The candidates of a step are tested in parallel by jobs threads, so test
+    has to be thread safe.
+    '''
+    def __init__(self, test, jobs=4, maxTests=1000):
+        '''
+        @param test:        Called with a program.Program, True if it is still interesting
+        @param jobs:        The number of tests running at the same time
+        @param maxTests:    Stop minimizing after this many tests
+        '''
+        self.test = test
+        self.jobs = jobs
+        self.maxTests = maxTests
+        self.tests = 0
+        self.current = []
+        self.nextVariable = 0
+        self.definitions = set()
+        self.visibleInputs = {}
+        self._pool = None
+        # the tests of a step run in the threads of _pool
+        self._testsLock = threading.Lock()
+
+    def minimize(self, prog):
+        '''The smallest program found that still passes the test, None if prog itself does not pass'''
+        self.tests = 0
+        self.nextVariable = prog.nextVariable
+        self._setCurrent(list(prog.instructionList))
+        if not self._test(self.current):
+            logger.warning("The program does not pass the test, nothing to minimize")
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as self._pool:
+            size = None
+            while size != self._size() and self.tests < self.maxTests:
+                size = self._size()
+                self._reduceBlocks()
+                self._reduceArguments()
+        self._pool = None
+
+        logger.info("Minimized %d instructions to %d in %d tests" % (len(prog.instructionList), len(self.current), self.tests))
+        return self._program(self.current)
+
+    def _size(self):
+        return len(self.current) + sum(len(inst.inputs) + len(inst.temp) for inst in self.current)
+
+    def _program(self, insts):
+        prog = program.Program(list(insts))
+        prog.nextVariable = self.nextVariable
+        return prog
+
+    def _test(self, insts):
+        with self._testsLock:
+            self.tests += 1
+        try:
+            return self.test(self._program(insts))
+        except Exception as e:
+            logger.debug("Test failed: %r" % e)
+            return False
+
+    ''''Consistency'''
+
+    '''The variables inst reads, including the ones in the pairs of CreateDict and the outer variables of a function'''
+    @staticmethod
+    def _inputVars(inst):
+        for inp in inst.inputs:
+            if isinstance(inp, tuple):
+                yield from (x for x in inp if isinstance(x, variable.Variable))
+            elif isinstance(inp, variable.Variable):
+                yield inp
+        if inst.isBeginFunction():
+            yield from inst.operation.signature.getOuterVars()
+
+    def _setCurrent(self, insts):
+        '''Make insts the program to minimize and remember what it defines and which inputs are in scope where'''
+        self.current = insts
+        self.definitions = set()
+        self.visibleInputs = {}
+        scopes = analyzer.ScopeAnalyzer(program.Program([]))
+        for inst in insts:
+            visible = set(scopes.getVisibleVars())
+            self.visibleInputs[inst] = [var for var in self._inputVars(inst) if var in visible]
+            self.definitions.update(inst.outputs)
+            self.definitions.update(inst.temp)
+            scopes.analyze(inst)
+
+    def _isConsistent(self, insts):
+        defined = set()
+        scopes = analyzer.ScopeAnalyzer(program.Program([]))
+        for inst in insts:
+            for var in self._inputVars(inst):
+                if var in self.definitions and var not in defined:
+                    return False
+            if inst in self.visibleInputs:
+                visible = set(scopes.getVisibleVars())
+                if any(var not in visible for var in self.visibleInputs[inst]):
+                    return False
+            defined.update(inst.outputs)
+            defined.update(inst.temp)
+            scopes.analyze(inst)
+        return True
+
+    '''The first of the candidates that is consistent and passes the test, None if there is none'''
+    def _firstPassing(self, candidates):
+        candidates = [insts for insts in candidates if self._isConsistent(insts)]
+        budget = self.maxTests - self.tests
+        if budget <= 0 or len(candidates) == 0:
+            return None
+        candidates = candidates[:budget]
+
+        futures = [self._pool.submit(self._test, insts) for insts in candidates]
+        result = None
+        for insts, future in zip(candidates, futures):
+            if result is None and future.result():
+                result = insts
+            elif result is not None:
+                future.cancel()
+        return result
+
+    ''''Blocks and instructions'''
+
+    def _blockEnd(self, start):
+        depth = 0
+        for idx in range(start, len(self.current)):
+            inst = self.current[idx]
+            if inst.isBlockEnd():
+                depth -= 1
+            if inst.isBlockBegin():
+                depth += 1
+            if depth == 0:
+                return idx
+        return len(self.current) - 1
+
+    def _parse(self, lo, hi):
+        '''The nodes of the instructions lo to hi'''
+        nodes = []
+        idx = lo
+        while idx <= hi:
+            inst = self.current[idx]
+            opcode = inst.getOpcode()
+            if opcode in (Opcode.BeginElse, Opcode.BeginCatch):
+                # an if works without its else, a try does not work without its catch
+                nodes.append(Node(idx, hi, opcode == Opcode.BeginElse, self._parse(idx+1, hi)))
+                break
+            if inst.isBlockBegin():
+                end = self._blockEnd(idx)
+                nodes.append(Node(idx, end, True, self._parse(idx+1, end-1)))
+                idx = end + 1
+            else:
+                nodes.append(Node(idx, idx, True, []))
+                idx += 1
+        return nodes
+
+    def _nodesAt(self, depth):
+        nodes = self._parse(0, len(self.current) - 1)
+        for _ in range(depth):
+            nodes = [child for node in nodes for child in node.children]
+        return nodes
+
+    def _without(self, nodes):
+        removed = set()
+        for node in nodes:
+            removed.update(range(node.start, node.end + 1))
+        return [inst for idx, inst in enumerate(self.current) if idx not in removed]
+
+    def _reduceBlocks(self):
+        depth = 0
+        while len(self._nodesAt(depth)) > 0:
+            self._ddmin(depth)
+            depth += 1
+
+    def _ddmin(self, depth):
+        '''Remove chunks of the nodes at depth, the chunks get smaller until every node is tried on its own'''
+        nodes = [node for node in self._nodesAt(depth) if node.removable]
+        chunks = min(2, len(nodes))
+        while len(nodes) > 0 and self.tests < self.maxTests:
+            size = (len(nodes) + chunks - 1) // chunks
+            candidates = [self._without(nodes[i:i+size]) for i in range(0, len(nodes), size)]
+            result = self._firstPassing(candidates)
+            if result is not None:
+                self._setCurrent(result)
+                nodes = [node for node in self._nodesAt(depth) if node.removable]
+                chunks = max(min(chunks - 1, len(nodes)), 1)
+            elif chunks < len(nodes):
+                chunks = min(2 * chunks, len(nodes))
+            else:
+                break
+
+    ''''Arguments'''
+
+    def _reduceArguments(self):
+        while self.tests < self.maxTests:
+            candidates = []
+            for idx, inst in enumerate(self.current):
+                if inst.getOpcode() == Opcode.CallFunction:
+                    for pos in range(1, len(inst.inputs)):
+                        candidates.append(self._withoutArgument(idx, pos))
+                elif inst.isBeginFunction():
+                    for pos in range(len(inst.temp)):
+                        candidates.append(self._withoutParameter(idx, pos))
+            result = self._firstPassing(candidates)
+            if result is None:
+                break
+            self._setCurrent(result)
+
+    def _replace(self, insts, idx, new):
+        # the new instruction has to keep the inputs of the old one in scope
+        self.visibleInputs.setdefault(new, self.visibleInputs.get(insts[idx], []))
+        insts[idx] = new
+
+    def _withoutArgument(self, idx, pos):
+        insts = list(self.current)
+        inst = insts[idx]
+        inputs = inst.inputs[:pos] + inst.inputs[pos+1:]
+        self._replace(insts, idx, instructions.Instruction(operation.CallFunction(len(inputs) - 1), inputs, inst.outputs, inst.temp))
+        return insts
+
+    def _withoutParameter(self, idx, pos):
+        '''Remove a parameter of a function and the argument every call of the function passes for it'''
+        insts = list(self.current)
+        inst = insts[idx]
+        old = inst.operation.signature
+        signature = typesData.FunctionSignature(old.numArgs - 1, list(old.getOuterVars()))
+        signature.setInputTypes(old.getInputTypes()[:pos] + old.getInputTypes()[pos+1:])
+        signature.setReturnType(old.getReturnType())
+        temps = inst.temp[:pos] + inst.temp[pos+1:]
+        self._replace(insts, idx, instructions.Instruction(operation.BeginFunction(signature), inst.inputs, inst.outputs, temps))
+
+        function = inst.getOutput()
+        for callIdx, call in enumerate(insts):
+            if call.getOpcode() == Opcode.CallFunction and call.inputs[0] == function and len(call.inputs) > pos + 1:
+                inputs = call.inputs[:pos+1] + call.inputs[pos+2:]
+                self._replace(insts, callIdx, instructions.Instruction(operation.CallFunction(len(inputs) - 1), inputs, call.outputs, call.temp))
+        return insts
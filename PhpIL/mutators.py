@@ -0,0 +1,256 @@
+import logging
+
+from . import program_builder
+from . import instructions
+from . import operation
+from . import typesData
+from . import variable
+from . import analyzer
+from . import probability
+from . import settings
+from .opcode import Opcode
+
+logger = logging.getLogger('Mutator')
+
+class Mutator:
+    '''
+    Mutators take a program (and the corpus for the ones that combine
+    programs) and return a new program or False if the mutation failed.
+    The new program is rebuilt instruction by instruction through a
+    ProgramBuilder so that it goes through the scope, context and type
+    analyzers like a freshly generated one.
+    '''
+
+    @staticmethod
+    def mutate(prog, corpus=None, tries=10):
+        '''Mutate prog with one of Settings.allMutators, returns None if every try failed'''
+        for _ in range(tries):
+            choice = probability.Random.chooseWeightedBiased(settings.Settings.allMutators)
+            ret = choice(prog, corpus)
+            if ret:
+                return ret
+        return None
+
+    ''''Utility functions start'''
+
+    '''A builder to replay prog in, variables it creates do not clash with the ones in prog'''
+    @staticmethod
+    def _builder(prog):
+        pb = program_builder.ProgramBuilder(init_builtins=True)
+        pb.nextFreeVariable = prog.nextVariable
+        return pb
+
+    '''Append an instruction of the program being replayed'''
+    @staticmethod
+    def _append(pb, inst):
+        if inst.isBeginFunction():
+            # the type analyzer updates signatures in place, so do not share them with the original
+            oldSignature = inst.operation.signature
+            signature = typesData.FunctionSignature(oldSignature.numArgs, list(oldSignature.getOuterVars()))
+            inst = instructions.Instruction(operation.BeginFunction(signature), inst.inputs, inst.outputs, inst.temp)
+        pb.instructionAppend(inst)
+
+    '''Index of the instruction that closes the block opened at start'''
+    @staticmethod
+    def _blockEnd(prog, start):
+        depth = 0
+        for idx in range(start, len(prog.instructionList)):
+            inst = prog.instructionList[idx]
+            if inst.isBlockEnd():
+                depth -= 1
+            if inst.isBlockBegin():
+                depth += 1
+            if depth == 0:
+                return idx
+        return None
+
+    '''Apply func to every variable in a list of inputs, looking into the (key, value) pairs of CreateDict'''
+    @staticmethod
+    def _mapInputs(inputs, func):
+        mapped = []
+        for inp in inputs:
+            if isinstance(inp, tuple):
+                mapped.append(tuple(func(x) if isinstance(x, variable.Variable) else x for x in inp))
+            elif isinstance(inp, variable.Variable):
+                mapped.append(func(inp))
+            else:
+                mapped.append(inp)
+        return mapped
+
+    '''Positions of the inputs of inst that can be replaced by another variable'''
+    @staticmethod
+    def _mutableInputs(inst):
+        # the callee of a call has to stay a function
+        first = 1 if inst.getOpcode() == Opcode.CallFunction else 0
+        return [i for i in range(first, len(inst.inputs)) if isinstance(inst.inputs[i], variable.Variable)]
+
+    ''''Utility functions end'''
+
+    '''Replace one input of an instruction with another visible variable of the same type'''
+    @staticmethod
+    def inputMutator(prog, corpus):
+        candidates = [i for i, inst in enumerate(prog.instructionList) if len(Mutator._mutableInputs(inst)) > 0]
+        if len(candidates) == 0:
+            return False
+        target = probability.Random.chooseUniform(candidates)
+
+        pb = Mutator._builder(prog)
+        for idx, inst in enumerate(prog.instructionList):
+            if idx == target:
+                pos = probability.Random.chooseUniform(Mutator._mutableInputs(inst))
+                old = inst.inputs[pos]
+                new = pb.randVar(pb.typeAnalyzer.getType(old))
+                if not isinstance(new, variable.Variable) or new == old:
+                    return False
+                inputs = list(inst.inputs)
+                inputs[pos] = new
+                inst = instructions.Instruction(inst.operation, inputs, inst.outputs, inst.temp)
+            Mutator._append(pb, inst)
+
+        return pb.finish()
+
+    '''Change the operator, comparater or literal value of an operation'''
+    @staticmethod
+    def operationMutator(prog, corpus):
+        mutable = [Opcode.LoadInteger, Opcode.LoadFloat, Opcode.LoadString, Opcode.LoadBoolean,
+                   Opcode.UnaryOperation, Opcode.BinaryOperation, Opcode.BeginWhile, Opcode.EndDoWhile]
+        candidates = [i for i, inst in enumerate(prog.instructionList) if inst.getOpcode() in mutable]
+        if len(candidates) == 0:
+            return False
+        target = probability.Random.chooseUniform(candidates)
+
+        pb = Mutator._builder(prog)
+        for idx, inst in enumerate(prog.instructionList):
+            if idx == target:
+                inst = instructions.Instruction(Mutator._mutateOperation(pb, inst.operation), inst.inputs, inst.outputs, inst.temp)
+            Mutator._append(pb, inst)
+
+        return pb.finish()
+
+    @staticmethod
+    def _mutateOperation(pb, op):
+        opcode = op.opcode
+        if opcode == Opcode.LoadInteger:
+            return operation.LoadInteger(probability.Random.withEqualProbability(
+                lambda: pb.getInt(),
+                lambda: op.value + probability.Random.randomInt(-16, 16),
+                lambda: probability.Random.chooseUniform([0, -1, 1 << 31, (1 << 31) - 1, (1 << 63) - 1, -(1 << 63)]),
+            ))
+        if opcode == Opcode.LoadFloat:
+            return operation.LoadFloat(pb.getFloat())
+        if opcode == Opcode.LoadString:
+            return operation.LoadString(pb.getString())
+        if opcode == Opcode.LoadBoolean:
+            return operation.LoadBoolean(not op.value)
+        if opcode == Opcode.UnaryOperation:
+            return operation.UnaryOperation(probability.Random.chooseUniform(operation.UnaryOperator.all()))
+        if opcode == Opcode.BinaryOperation:
+            return operation.BinaryOperation(probability.Random.chooseUniform(operation.BinaryOperator.all()))
+        if opcode == Opcode.BeginWhile:
+            return operation.BeginWhile(probability.Random.chooseUniform(operation.Comparater.all()))
+        if opcode == Opcode.EndDoWhile:
+            return operation.EndDoWhile(probability.Random.chooseUniform(operation.Comparater.all()))
+
+    '''Insert freshly generated code at a random point'''
+    @staticmethod
+    def codeGenMutator(prog, corpus):
+        # also allow appending at the very end
+        target = probability.Random.randomInt(0, len(prog.instructionList))
+
+        pb = Mutator._builder(prog)
+        for idx, inst in enumerate(prog.instructionList):
+            if idx == target:
+                pb.generateRandomInst()
+            Mutator._append(pb, inst)
+        if target == len(prog.instructionList):
+            pb.generateRandomInst()
+
+        return pb.finish()
+
+    '''Insert one instruction or block of another program at a random point'''
+    @staticmethod
+    def spliceMutator(prog, corpus):
+        if corpus is None or len(corpus) == 0:
+            return False
+        donor = corpus.randomElement()
+        indices = [i for i, inst in enumerate(donor.instructionList) if not inst.isBlockEnd()]
+        if len(indices) == 0:
+            return False
+        start = probability.Random.chooseUniform(indices)
+        end = start
+        if donor.instructionList[start].isBlockBegin():
+            end = Mutator._blockEnd(donor, start)
+            if end is None:
+                return False
+        return Mutator._insert(prog, donor, donor.instructionList[start:end+1])
+
+    '''Insert all the code of another program at a random point'''
+    @staticmethod
+    def combineMutator(prog, corpus):
+        if corpus is None or len(corpus) == 0:
+            return False
+        donor = corpus.randomElement()
+        if len(donor.instructionList) == 0:
+            return False
+        return Mutator._insert(prog, donor, donor.instructionList)
+
+    @staticmethod
+    def _insert(prog, donor, code):
+        needsLoop = any(inst.getOpcode() in (Opcode.Break, Opcode.Continue) for inst in code)
+        needsFunction = any(inst.getOpcode() == Opcode.Return for inst in code)
+        donorTypes = None
+
+        target = probability.Random.randomInt(0, len(prog.instructionList))
+
+        pb = Mutator._builder(prog)
+        for idx, inst in enumerate(prog.instructionList + [None]):
+            if idx == target:
+                if needsLoop and not pb.isInLoop():
+                    return False
+                if needsFunction and not pb.isInFunction():
+                    return False
+                if donorTypes is None:
+                    donorTypes = analyzer.TypeAnalyzer(donor, pb.environment)
+                    donorTypes.doAnalyze()
+                if not Mutator._appendForeign(pb, code, donorTypes):
+                    return False
+            if inst is not None:
+                Mutator._append(pb, inst)
+
+        return pb.finish()
+
+    '''Append instructions of another program, renaming their variables into the current one'''
+    @staticmethod
+    def _appendForeign(pb, code, donorTypes):
+        renamed = {}
+
+        def rename(var):
+            if var in renamed:
+                return renamed[var]
+            # builtins come from the shared environment and mean the same in every program
+            if var in pb.environment:
+                return var
+            new = pb.randVar(donorTypes.getType(var))
+            if not isinstance(new, variable.Variable):
+                raise KeyError(f"No replacement for {var}")
+            renamed[var] = new
+            return new
+
+        def fresh(var):
+            renamed[var] = pb.nextVariable()
+            return renamed[var]
+
+        try:
+            for inst in code:
+                inputs = Mutator._mapInputs(inst.inputs, rename)
+                op = inst.operation
+                if inst.isBeginFunction():
+                    outerVars = [rename(var) for var in op.signature.getOuterVars()]
+                    op = operation.BeginFunction(typesData.FunctionSignature(op.signature.numArgs, outerVars))
+                outputs = [fresh(var) for var in inst.outputs]
+                temps = [fresh(var) for var in inst.temp]
+                pb.instructionAppend(instructions.Instruction(op, inputs, outputs, temps))
+        except KeyError as e:
+            logger.debug("Could not splice: %s" % e)
+            return False
+        return True
@@ -1,6 +1,15 @@
 from .opcode import Opcode, opcode_list
 
 class Operation(object):
+    '''
+    The opcode, the number of inputs, outputs and temporaries and the flags
+    of an operation are the same for every instance of its class, so they are
+    class attributes. Only operations whose arity depends on their arguments
+    (calls, arrays, functions) keep it per instance. Operations without
+    parameters never change, so all instructions share one instance of them:
+    EndIf() is EndIf() holds. Operations have __slots__ to keep programs small.
+    '''
+    __slots__ = ()
 
     class Attributes:
         isPrimitive        = 1 << 0
@@ -16,15 +25,27 @@ class Operation(object):
         isImmutable        = 1 << 10
         isVarargs          = 1 << 11
 
-    def __init__(self, numInputs, numOutputs, numTempvars, attributes=[]):
-        self.opcode = 0
-        self.numInputs = numInputs
-        self.numOutputs = numOutputs
-        self.numTempvars = numTempvars
-        self.attributes = attributes
-        self.flags = 0
-        for i in attributes:
-            self.flags |= i
+    opcode = 0
+    numInputs = 0
+    numOutputs = 0
+    numTempvars = 0
+    attributes = ()
+    flags = 0
+    _shared = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.flags = 0
+        for i in cls.attributes:
+            cls.flags |= i
+        cls._shared = None
+        if cls.__init__ is object.__init__:
+            cls._shared = object.__new__(cls)
+
+    def __new__(cls, *args, **kwargs):
+        if cls._shared is not None:
+            return cls._shared
+        return object.__new__(cls)
 
     def getFlags(self):
         return self.flags
@@ -49,50 +70,56 @@ class Operation(object):
         return output + opcode_list[self.opcode.value] + " " + input
 
 class Nop(Operation):
-    def __init__(self):
-        super(Nop, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isPrimitive])
-        self.opcode = Opcode.Nop
+    opcode = Opcode.Nop
+    attributes = (Operation.Attributes.isPrimitive,)
 
 class LoadInteger(Operation):
+    __slots__ = ('value',)
+    opcode = Opcode.LoadInteger
+    numOutputs = 1
+
     def __init__(self, value):
-        super(LoadInteger, self).__init__(numInputs=0, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.LoadInteger
         self.value = value
 
     def __str__(self):
         return "out0 = " + opcode_list[self.opcode.value] + " " + "'" + str(self.value) + "'"
 
 class LoadFloat(Operation):
+    __slots__ = ('value',)
+    opcode = Opcode.LoadFloat
+    numOutputs = 1
+
     def __init__(self, value):
-        super(LoadFloat, self).__init__(numInputs=0, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.LoadFloat
         self.value = value
 
     def __str__(self):
         return "out0 = " + opcode_list[self.opcode.value] + " " + "'" + str(self.value) + "'"
 
 class LoadString(Operation):
+    __slots__ = ('value',)
+    opcode = Opcode.LoadString
+    numOutputs = 1
+
     def __init__(self, value):
-        super(LoadString, self).__init__(numInputs=0, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.LoadString
         self.value = value
 
     def __str__(self):
         return "out0 = " + opcode_list[self.opcode.value] + " " + "'" + str(self.value) + "'"
 
 class LoadBoolean(Operation):
+    __slots__ = ('value',)
+    opcode = Opcode.LoadBoolean
+    numOutputs = 1
+
     def __init__(self, value):
-        super(LoadBoolean, self).__init__(numInputs=0, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.LoadBoolean
         self.value = value
 
     def __str__(self):
         return "out0 = " + opcode_list[self.opcode.value] + " " + "'" + str(self.value) + "'"
 
 class LoadNull(Operation):
-    def __init__(self):
-        super(LoadNull, self).__init__(numInputs=0, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.LoadNull
+    opcode = Opcode.LoadNull
+    numOutputs = 1
 
 # class LoadObject (Operation):
 #     def __init__(self, value):
@@ -101,39 +128,46 @@ class LoadNull(Operation):
 #         self.value = value
 
 class CreateObject(Operation):
+    __slots__ = ('object', 'args')
+    opcode = Opcode.CreateObject
+    numInputs = 1
+    numOutputs = 1
+
     def __init__(self, object, args):
-        super(CreateObject, self).__init__(numInputs=1, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.CreateObject
         self.object = object
         self.args = args
 
 class CreateArray(Operation):
+    __slots__ = ('numInputs',)
+    opcode = Opcode.CreateArray
+    numOutputs = 1
+
     def __init__(self, numInitialValues):
-        super(CreateArray, self).__init__(numInputs=numInitialValues, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.CreateArray
+        self.numInputs = numInitialValues
 
 class BeginIf(Operation):
-    def __init__(self):
-        super(BeginIf, self).__init__(numInputs=1, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockBegin])
-        self.opcode = Opcode.BeginIf
+    opcode = Opcode.BeginIf
+    numInputs = 1
+    attributes = (Operation.Attributes.isBlockBegin,)
 
 
 class BeginElse(Operation):
-    def __init__(self):
-        super(BeginElse, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockBegin, Operation.Attributes.isBlockEnd])
-        self.opcode = Opcode.BeginElse
+    opcode = Opcode.BeginElse
+    attributes = (Operation.Attributes.isBlockBegin, Operation.Attributes.isBlockEnd)
 
 
 class EndIf(Operation):
-    def __init__(self):
-        super(EndIf, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockEnd])
-        self.opcode = Opcode.EndIf
+    opcode = Opcode.EndIf
+    attributes = (Operation.Attributes.isBlockEnd,)
 
 
 class BeginWhile(Operation):
+    __slots__ = ('comparater',)
+    opcode = Opcode.BeginWhile
+    numInputs = 2
+    attributes = (Operation.Attributes.isBlockBegin, Operation.Attributes.isLoopBegin)
+
     def __init__(self, comparater):
-        super(BeginWhile, self).__init__(numInputs=2, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockBegin, Operation.Attributes.isLoopBegin])
-        self.opcode = Opcode.BeginWhile
         self.comparater = comparater
 
     def __str__(self):
@@ -142,14 +176,17 @@ class BeginWhile(Operation):
 
 
 class EndWhile(Operation):
-    def __init__(self):
-        super(EndWhile, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockEnd, Operation.Attributes.isLoopEnd])
-        self.opcode = Opcode.EndWhile
+    opcode = Opcode.EndWhile
+    attributes = (Operation.Attributes.isBlockEnd, Operation.Attributes.isLoopEnd)
 
 class BeginFor(Operation):
+    __slots__ = ('comparater', 'op')
+    opcode = Opcode.BeginFor
+    numInputs = 3
+    numTempvars = 1
+    attributes = (Operation.Attributes.isBlockBegin, Operation.Attributes.isLoopBegin)
+
     def __init__(self, comparater, op):
-        super(BeginFor, self).__init__(numInputs=3, numOutputs=0, numTempvars=1, attributes=[Operation.Attributes.isBlockBegin, Operation.Attributes.isLoopBegin])
-        self.opcode = Opcode.BeginFor
         self.op = op
         self.comparater = comparater
 
@@ -158,54 +195,54 @@ class BeginFor(Operation):
         return opcode_list[self.opcode.value] + input
 
 class EndFor(Operation):
-    def __init__(self):
-        super(EndFor, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockEnd, Operation.Attributes.isLoopEnd])
-        self.opcode = Opcode.EndFor
+    opcode = Opcode.EndFor
+    attributes = (Operation.Attributes.isBlockEnd, Operation.Attributes.isLoopEnd)
 
 class BeginDoWhile(Operation):
-    def __init__(self):
-        super(BeginDoWhile, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockBegin, Operation.Attributes.isLoopBegin])
-        self.opcode = Opcode.BeginDoWhile
+    opcode = Opcode.BeginDoWhile
+    attributes = (Operation.Attributes.isBlockBegin, Operation.Attributes.isLoopBegin)
 
 class EndDoWhile(Operation):
+    __slots__ = ('comparater',)
+    opcode = Opcode.EndDoWhile
+    numInputs = 2
+    attributes = (Operation.Attributes.isBlockEnd, Operation.Attributes.isLoopEnd)
+
     def __init__(self, comparater):
-        super(EndDoWhile, self).__init__(numInputs=2, numOutputs=0, numTempvars=0, attributes=[Operation.Attributes.isBlockEnd, Operation.Attributes.isLoopEnd])
-        self.opcode = Opcode.EndDoWhile
         self.comparater = comparater
 
 class EndForEach(Operation):
-    def __init__(self):
-        super(EndForEach, self).__init__(numInputs=0, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.EndIf
+    opcode = Opcode.EndIf
 
 class Return(Operation):
-    def __init__(self):
-        super(Return, self).__init__(numInputs=1, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.Return
+    opcode = Opcode.Return
+    numInputs = 1
 
 class Break(Operation):
-    def __init__(self):
-        super(Break, self).__init__(numInputs=0, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.Break
+    opcode = Opcode.Break
 
 class Continue(Operation):
-    def __init__(self):
-        super(Continue, self).__init__(numInputs=0, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.Continue
+    opcode = Opcode.Continue
 
 class UnaryOperation(Operation):
+    __slots__ = ('op',)
+    opcode = Opcode.UnaryOperation
+    numInputs = 1
+    numOutputs = 1
+
     def __init__(self, op):
-        super(UnaryOperation, self).__init__(numInputs=1, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.UnaryOperation
         self.op = op
 
     def __str__(self):
         return "out0 = " + opcode_list[self.opcode.value] + " " + str(self.op) + " inp0"
 
 class BinaryOperation(Operation):
+    __slots__ = ('op',)
+    opcode = Opcode.BinaryOperation
+    numInputs = 2
+    numOutputs = 1
+
     def __init__(self, op):
-        super(BinaryOperation, self).__init__(numInputs=2, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.BinaryOperation
         self.op = op
 
     def __str__(self):
@@ -213,84 +250,91 @@ class BinaryOperation(Operation):
 
 
 class Include(Operation):
-    def __init__(self):
-        super(Include, self).__init__(numInputs=1, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.Include
+    opcode = Opcode.Include
+    numInputs = 1
 
 class Eval(Operation):
+    __slots__ = ('value',)
+    opcode = Opcode.Eval
+    numInputs = 1
+
     def __init__(self, value):
-        super(Eval, self).__init__(numInputs=1, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.Eval
         self.value = value
 
 
 class Phi(Operation):
-    def __init__(self):
-        super(Phi, self).__init__(numInputs = 1, numOutputs = 1, numTempvars = 0)
-        self.opcode = Opcode.Phi
+    opcode = Opcode.Phi
+    numInputs = 1
+    numOutputs = 1
 
 class Copy(Operation):
-    def __init__(self):
-        super(Copy, self).__init__(numInputs = 2, numOutputs = 0, numTempvars = 0)
-        self.opcode = Opcode.Copy
+    opcode = Opcode.Copy
+    numInputs = 2
 
 class BeginFunction(Operation):
+    __slots__ = ('numTempvars', 'signature')
+    opcode = Opcode.BeginFunction
+    numOutputs = 1
+    attributes = (Operation.Attributes.isBlockBegin,)
+
     def __init__(self,signature):
-        super(BeginFunction, self).__init__(numInputs = 0, numOutputs = 1, numTempvars = signature.numArgs, attributes = [Operation.Attributes.isBlockBegin])
-        self.opcode = Opcode.BeginFunction
+        self.numTempvars = signature.numArgs
         self.signature = signature
 
 class BuiltinFunction(Operation):
+    __slots__ = ('numTempvars', 'name', 'signature')
+    opcode = Opcode.BuiltinMethod
+    numOutputs = 1
+
     def __init__(self, name, signature):
-        super(BuiltinFunction, self).__init__(numInputs=0, numOutputs=1, numTempvars=signature.numArgs)
-        self.opcode = Opcode.BuiltinMethod
+        self.numTempvars = signature.numArgs
         self.name = name
         self.signature = signature
 
 class EndFunction(Operation):
-    def __init__(self):
-        super(EndFunction, self).__init__(numInputs=0, numOutputs=0, numTempvars=0, attributes = [Operation.Attributes.isBlockEnd])
-        self.opcode = Opcode.EndFunction
+    opcode = Opcode.EndFunction
+    attributes = (Operation.Attributes.isBlockEnd,)
 
 class CallFunction(Operation):
+    __slots__ = ('numInputs',)
+    opcode = Opcode.CallFunction
+    numOutputs = 1
+
     def __init__(self, numArgs):
-        super(CallFunction, self).__init__(numInputs=numArgs+1, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.CallFunction
+        self.numInputs = numArgs+1
 
 class ThrowException(Operation):
-    def __init__(self):
-        super(ThrowException, self).__init__(numInputs = 1, numOutputs= 0, numTempvars = 0, attributes = [])
-        self.opcode = Opcode.ThrowException
+    opcode = Opcode.ThrowException
+    numInputs = 1
 
 class BeginTry(Operation):
-    def __init__(self):
-        super(BeginTry, self).__init__(numInputs= 0, numOutputs= 0, numTempvars = 0, attributes = [Operation.Attributes.isBlockBegin])
-        self.opcode = Opcode.BeginTry
+    opcode = Opcode.BeginTry
+    attributes = (Operation.Attributes.isBlockBegin,)
 
 class BeginCatch(Operation):
-    def __init__(self):
-        super(BeginCatch, self).__init__(numInputs = 0, numOutputs= 0, numTempvars = 0, attributes = [Operation.Attributes.isBlockBegin, Operation.Attributes.isBlockEnd])
-        self.opcode = Opcode.BeginCatch
+    opcode = Opcode.BeginCatch
+    attributes = (Operation.Attributes.isBlockBegin, Operation.Attributes.isBlockEnd)
 
 class EndTryCatch(Operation):
-    def __init__(self):
-        super(EndTryCatch, self).__init__(numInputs = 0, numOutputs= 0, numTempvars = 0, attributes = [Operation.Attributes.isBlockEnd])
-        self.opcode = Opcode.EndTryCatch
+    opcode = Opcode.EndTryCatch
+    attributes = (Operation.Attributes.isBlockEnd,)
 
 class CreateDict(Operation):
+    __slots__ = ('numInputs',)
+    opcode = Opcode.CreateDict
+    numOutputs = 1
+
     def __init__(self, numInitialValues):
-        super(CreateDict, self).__init__(numInputs=numInitialValues, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.CreateDict
+        self.numInputs = numInitialValues
 
 class GetArrayElem(Operation):
-    def __init__(self):
-        super(GetArrayElem, self).__init__(numInputs=2, numOutputs=1, numTempvars=0)
-        self.opcode = Opcode.GetArrayElem
+    opcode = Opcode.GetArrayElem
+    numInputs = 2
+    numOutputs = 1
 
 class SetArrayElem(Operation):
-    def __init__(self):
-        super(SetArrayElem, self).__init__(numInputs=3, numOutputs=0, numTempvars=0)
-        self.opcode = Opcode.SetArrayElem
+    opcode = Opcode.SetArrayElem
+    numInputs = 3
 
 class BeginClass(Operation):
     pass
@@ -302,13 +346,11 @@ class BeginForEach(Operation):
     pass
 
 class Print(Operation):
-    def __init__(self):
-        super(Print, self).__init__(numInputs = 1, numOutputs= 0, numTempvars = 0, attributes = [])
-        self.opcode = Opcode.Print
+    opcode = Opcode.Print
+    numInputs = 1
 class VarPrefix(Operation):
-    def __init__(self):
-        super(VarPrefix, self).__init__(numInputs = 1, numOutputs=0, numTempvars = 0, attributes = [])
-        self.opcode = Opcode. VarPrefix
+    opcode = Opcode. VarPrefix
+    numInputs = 1
 
 class Comparater:
     equal               = "=="
@@ -1,8 +1,30 @@
 import random
 import string
+import bisect
+import itertools
+
+class WeightedChooser:
+
+    '''Picks items with a probability proportional to their weights in O(log n)'''
+    def __init__(self, items, weights):
+        self.items = list(items)
+        self.weights = list(weights)
+        self.cumWeights = list(itertools.accumulate(self.weights))
+        self.total = self.cumWeights[-1]
+        assert self.total > 0, "At least one weight has to be positive"
+
+    def choose(self):
+        idx = bisect.bisect_right(self.cumWeights, random.random() * self.total)
+        # random() * total can round up to total
+        return self.items[min(idx, len(self.items) - 1)]
 
 class Random:
 
+    # dict id -> (dict, WeightedChooser) for chooseWeightedBiased, the dict is kept so that its id is not reused
+    _weightedChoosers = {}
+    # (list length, factor) -> WeightedChooser over the indices for chooseBiased
+    _biasedChoosers = {}
+
     '''Returns True if the probability is achieved and False otherwise'''
     @staticmethod
     def probability(prob):
@@ -57,24 +79,32 @@ class Random:
         if size == 1:
             return lst[0]
 
-        x = 0
-        for i in range(size):
-            x += factor**i
-
-        prob = (factor**(size-1))*(1.0/(x))
+        key = (size, factor)
+        chooser = Random._biasedChoosers.get(key)
+        if chooser is None:
+            # element i has weight factor**i, scaled by the weight of the last one to stay within float range
+            chooser = WeightedChooser(range(size), [float(factor)**(i-size+1) for i in range(size)])
+            Random._biasedChoosers[key] = chooser
+        return lst[chooser.choose()]
 
-        return Random.withprobability(prob, lambda: lst[size-1],
-                                    lambda: Random.chooseBiased(lst[:-1], factor))
+    '''
+    select a key of a dict with a probability proportional to its value
 
+    the cumulative weights are computed on the first pick from a dict, whoever
+    changes the weights of the dict afterwards has to call weightsChanged
+    '''
     @staticmethod
     def chooseWeightedBiased(d):
+        cached = Random._weightedChoosers.get(id(d))
+        if cached is None:
+            cached = (d, WeightedChooser(d.keys(), d.values()))
+            Random._weightedChoosers[id(d)] = cached
+        return cached[1].choose()
 
-        weights = list(d.values())
-        items = list(d.keys())
-        prob = weights[0]*(1.0/sum(weights))
-
-        return Random.withprobability(prob, lambda: items[0],
-                                    lambda: Random.chooseWeightedBiased(dict(zip(items[1:],weights[1:]))))
+    '''forget the cumulative weights of a dict, its next pick recomputes them'''
+    @staticmethod
+    def weightsChanged(d):
+        Random._weightedChoosers.pop(id(d), None)
 
 
     @staticmethod
@@ -9,6 +9,11 @@ class Program:
         elif len(args) == 1:
             self.instructionList = args[0]
 
+    def __reduce__(self):
+        # pickles of programs, like the ones sent between processes, use the format of serializer.py
+        from . import serializer
+        return (serializer.deserialize, (serializer.serialize(self),))
+
     def append(self, instruction):
         # print instruction
         self.instructionList.append(instruction)
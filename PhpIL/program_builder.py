@@ -1,5 +1,5 @@
-import os
-import json
+import time
+
 from . import program
 from . import instructions
 from . import typesData
@@ -8,6 +8,9 @@ from . import variable
 from . import operation
 from . import probability
 from . import settings
+from . import builtin_registry
+from . import stats
+from . import generator_stats
 from .opcode import Opcode
 from .code_generators import CodeGenerator
 
@@ -28,93 +31,80 @@ class ProgramBuilder:
         self.seenFloats = set([])
         self.seenStrings = set([])
 
+        # instructions emitted by the generators running inside the current one
+        self._nestedInstructions = 0
+
         self.scopeAnalyzer = analyzer.ScopeAnalyzer(self.program)
 
         self.contextAnalyzer = analyzer.ContextAnalyzer(self.program)
 
-        self.typeAnalyzer = analyzer.TypeAnalyzer(self.program)
-    
-        self.builtins = []
+        # the builtins live in a shared environment instead of the program
+        self.environment = builtin_registry.getEnvironment() if init_builtins is True else None
 
-        if init_builtins is True:
-            self._initialize_builtins()
+        self.typeAnalyzer = analyzer.TypeAnalyzer(self.program, self.environment)
+
+        self.variablePool = analyzer.VariablePool(self.program, self.scopeAnalyzer, self.typeAnalyzer)
+    
+        self.builtins = [] if self.environment is None else self.environment.builtins
 
         for i in self.program.instructionList:
             self.instructionList.append(i)
 
-    
-    def _read_builtin_funcs(self, filename='utils/builtin_func_map.json'):
-        utils_dir = os.path.abspath(os.path.join(__file__, '..', filename))
-        with open(utils_dir, 'r') as f:
-            content = f.read()
-            content = content.replace("Types.Unknown", "Types.Bad")
-            content = content.replace("Anything", "Types.Unknown")
-            content = content.replace("Variadic", "Types.Unknown")
-            func_map = json.loads(content)
-        
-        retval = []
-
-        black_list = ['posix_kill', 'sleep', 'time_sleep_unti']
-
-        for item in func_map:
-            if item['name'] in black_list:
-                continue
-            # TODO: we currently do not handle functions that take in resource-like object as input
-            if 'Types.Bad' in item['arg_types'] or 'Types.Class' in item['arg_types']:
-                continue
-            dtypes = [eval(x.replace("Types.", "typesData.Types.")) for x in item['arg_types']]
-            item['arg_types'] = dtypes
-            retval.append(item)
-        return retval 
-
-    def _initialize_builtins(self):
-        builtin_func_map = self._read_builtin_funcs()
-        # builtin_func_map = [{'name': 'var_dump', 'arg_num': 1, 'arg_types': [typesData.Types.Integer]}]
-        for item in builtin_func_map:
-            func_name = item['name']
-            num_args = item['arg_num']
-            arg_types = item['arg_types']
-            signature = typesData.FunctionSignature(num_args, [])
-            signature.setInputTypes(arg_types)
-            function = self.builtinFunction(func_name, signature)
-            self.builtins.append(function)
-
     '''Append a given instruction to the current program after performing analysis'''
     def instructionAppend(self, inst):
         # print inst
         self.scopeAnalyzer.analyze(inst)
         self.contextAnalyzer.analyze(inst)
         self.typeAnalyzer.analyze(inst)
+        self.variablePool.analyze(inst)
         self.instructionList.append(inst)
 
     ''''Utility functions start'''
 
-    '''finish this program builder and save the instructions to the program'''
-    def finish(self):
-        self.program = program.Program()
-        for i in self.instructionList:
-            self.program.append(i)
-        
-        self.scopeAnalyzer = analyzer.ScopeAnalyzer(self.program)
-        self.contextAnalyzer = analyzer.ContextAnalyzer(self.program)
-        self.typeAnalyzer = analyzer.TypeAnalyzer(self.program)
+    '''
+    finish this program builder and save the instructions to the program.
+    The analyzers already saw every instruction when it was appended so they
+    are kept as they are, verify=True analyzes the program again from scratch
+    and checks that both analyses agree.
+    '''
+    def finish(self, verify=False):
+        self.program = program.Program(list(self.instructionList))
+        self.program.nextVariable = self.nextFreeVariable
 
-        self.scopeAnalyzer.doAnalyze()
-        self.contextAnalyzer.doAnalyze()
-        self.typeAnalyzer.doAnalyze()
+        for a in (self.scopeAnalyzer, self.contextAnalyzer, self.typeAnalyzer, self.variablePool):
+            a.program = self.program
+
+        if verify:
+            self.verify()
 
         return self.program
 
+    '''Analyze the program from scratch and check the result against the incremental analysis'''
+    def verify(self):
+        scopeAnalyzer = analyzer.ScopeAnalyzer(self.program)
+        contextAnalyzer = analyzer.ContextAnalyzer(self.program)
+        typeAnalyzer = analyzer.TypeAnalyzer(self.program, self.environment)
+
+        scopeAnalyzer.doAnalyze()
+        contextAnalyzer.doAnalyze()
+        typeAnalyzer.doAnalyze()
+
+        assert scopeAnalyzer.scopes == self.scopeAnalyzer.scopes, "Scopes differ from the incremental analysis"
+        assert contextAnalyzer.context == self.contextAnalyzer.context, "Context differs from the incremental analysis"
+        assert typeAnalyzer.variableTypes == self.typeAnalyzer.variableTypes, "Types differ from the incremental analysis"
+
     def randVar(self, dtype=typesData.Types.Unknown, strict=0):
         """
         get variables of type <dtype>
         """
 
         candidates = []
-        ctr = 2 * len(self.scopeAnalyzer.scopes)
-        while len(candidates) == 0 and ctr > 0:
-            candidates = probability.Random.chooseBiased(self.scopeAnalyzer.scopes, 6)
-            candidates = list(filter(lambda x: self.typeAnalyzer.getType(x) == dtype or self.typeAnalyzer.getType(x) == typesData.Types.Unknown, candidates))
+        levels = range(len(self.scopeAnalyzer.scopes))
+        ctr = 2 * len(levels)
+        while ctr > 0:
+            ret = self.variablePool.choose(probability.Random.chooseBiased(levels, 6), dtype)
+            if ret is not None:
+                return ret
             ctr -= 1
 
         if len(candidates) == 0:
@@ -127,7 +117,8 @@ class ProgramBuilder:
             if dtype == typesData.Types.Integer:
                 candidates = [self.loadInteger(self.getInt())]
 
-            if dtype == typesData.Types.Unknown:
+            # nothing may be visible now that the builtins are not in the global scope
+            if dtype == typesData.Types.Unknown and self.scopeAnalyzer.hasVisibleVars():
                 while len(candidates) == 0:
                     candidates = probability.Random.chooseBiased(self.scopeAnalyzer.scopes, 5)
 
@@ -139,7 +130,7 @@ class ProgramBuilder:
 
     def generateRandomInst(self):
         ret = False
-        if len(self.scopeAnalyzer.getVisibleVars()) == 0:
+        if not self.scopeAnalyzer.hasVisibleVars():
             codegens = [
                 CodeGenerator.nullValueGenerator,
                 CodeGenerator.booleanLiteralGenerator,
@@ -148,11 +139,35 @@ class ProgramBuilder:
                 CodeGenerator.integerLiteralGenerator
             ]
 
-            return probability.Random.chooseBiased(codegens,1.5)(self)
+            return self.runGenerator(probability.Random.chooseBiased(codegens,1.5))
 
         while not ret:
             choice = probability.Random.chooseWeightedBiased(settings.Settings.allCodeGenerators)
-            ret = choice(self)
+            ret = self.runGenerator(choice)
+
+    '''Run a code generator, timing it and recording what it yields when stats are enabled'''
+    def runGenerator(self, generator):
+        timed = stats.tracker.enabled
+        recorded = generator_stats.tracker.enabled
+        if not timed and not recorded:
+            return generator(self)
+
+        start = time.perf_counter()
+        before = len(self.instructionList)
+        outerNested, self._nestedInstructions = self._nestedInstructions, 0
+        ret = generator(self)
+        emitted = len(self.instructionList) - before
+        own = emitted - self._nestedInstructions
+        self._nestedInstructions = outerNested + emitted
+
+        if timed:
+            name = "generator." + generator.__name__
+            stats.tracker.addTime(name, time.perf_counter() - start)
+            if not ret:
+                stats.tracker.count(name + ".failed")
+        if recorded:
+            generator_stats.tracker.record(generator, bool(ret), own)
+        return ret
 
     def getInt(self):
         def selectFromSeen():
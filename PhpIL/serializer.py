@@ -0,0 +1,289 @@
+import sys
+import struct
+import logging
+from array import array
+
+from . import columnar
+from . import typesData
+from . import variable
+
+logger = logging.getLogger('Serializer')
+
+'''
+The binary format of a program, everything little endian:
+
+    magic "PHPIL", u16 version
+    i64 nextVariable, u32 number of instructions
+    the operations used: u32 count, then for each the class name and the
+    names of its parameters, the kind column indexes this table
+    the columns of columnar.ColumnarProgram: u32 length and the raw int32s
+    the parameters, the raw inputs and the variable names as tagged values
+
+Operations are stored by class and parameter name, so a file stays
+readable when operation classes are added or reordered. Changes that a
+reader cannot map, like a removed class, bump VERSION.
+'''
+
+MAGIC = b'PHPIL'
+VERSION = 1
+
+# tags of the values in the parameters and raw inputs
+NONE, FALSE, TRUE, INT, BIGINT, FLOAT, STR, LIST, TUPLE, VARIABLE, SIGNATURE = range(11)
+
+COLUMNS = ('kinds', 'inputs', 'outputs', 'temps', 'inputOffsets', 'outputOffsets', 'tempOffsets', 'parameterIndex')
+
+_header = struct.Struct('<5sH')
+_counts = struct.Struct('<qI')
+_u8 = struct.Struct('<B')
+_u32 = struct.Struct('<I')
+_i32 = struct.Struct('<i')
+_i64 = struct.Struct('<q')
+_f64 = struct.Struct('<d')
+
+if array('i').itemsize != 4:
+    raise ImportError("The columns are written as int32, array('i') has %d bytes here" % array('i').itemsize)
+
+''''Writing'''
+
+def _writeStr(out, string):
+    data = string.encode('utf-8', errors='surrogatepass')
+    out += _u32.pack(len(data))
+    out += data
+
+def _writeValue(out, value):
+    # bool before int, True is an int too
+    if value is None:
+        out.append(NONE)
+    elif value is True:
+        out.append(TRUE)
+    elif value is False:
+        out.append(FALSE)
+    elif isinstance(value, int):
+        if -(1 << 63) <= value < (1 << 63):
+            out.append(INT)
+            out += _i64.pack(value)
+        else:
+            out.append(BIGINT)
+            _writeStr(out, str(value))
+    elif isinstance(value, float):
+        out.append(FLOAT)
+        out += _f64.pack(value)
+    elif isinstance(value, str):
+        out.append(STR)
+        _writeStr(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(LIST if isinstance(value, list) else TUPLE)
+        out += _u32.pack(len(value))
+        for item in value:
+            _writeValue(out, item)
+    elif isinstance(value, variable.Variable):
+        out.append(VARIABLE)
+        out += _i32.pack(value.id)
+        _writeValue(out, value._repr)
+    elif isinstance(value, typesData.FunctionSignature):
+        out.append(SIGNATURE)
+        out += _u32.pack(value.numArgs)
+        _writeValue(out, value.inputTypes)
+        _writeValue(out, value.returnType)
+        _writeValue(out, value.outerVars)
+        _writeValue(out, value.isCons)
+    else:
+        raise ValueError("Cannot serialize %r" % (value,))
+
+def _writeColumn(out, column):
+    if sys.byteorder == 'big':
+        column = array('i', column)
+        column.byteswap()
+    out += _u32.pack(len(column))
+    out += column.tobytes()
+
+def serialize(prog):
+    '''The program as bytes, see deserialize'''
+    columns = columnar.ColumnarProgram.fromProgram(prog)
+    out = bytearray(_header.pack(MAGIC, VERSION))
+    out += _counts.pack(columns.nextVariable, len(columns))
+
+    # only the operations the program uses, numbered in the order they first appear
+    kinds = {}
+    for kind in columns.kinds:
+        kinds.setdefault(kind, len(kinds))
+    out += _u32.pack(len(kinds))
+    for kind in kinds:
+        cls = columnar.OPERATIONS[kind]
+        _writeStr(out, cls.__name__)
+        names = columnar.parameterNames(cls)
+        out.append(len(names))
+        for name in names:
+            _writeStr(out, name)
+    columns.kinds = array('i', [kinds[kind] for kind in columns.kinds])
+
+    for name in COLUMNS:
+        _writeColumn(out, getattr(columns, name))
+
+    out += _u32.pack(len(columns.parameters))
+    for parameters in columns.parameters:
+        for value in parameters:
+            _writeValue(out, value)
+    out += _u32.pack(len(columns.rawInputs))
+    for pos, value in columns.rawInputs.items():
+        out += _u32.pack(pos)
+        _writeValue(out, value)
+    out += _u32.pack(len(columns.reprs))
+    for varId, name in columns.reprs.items():
+        out += _i32.pack(varId)
+        _writeStr(out, name)
+    return bytes(out)
+
+''''Reading'''
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def u8(self):
+        self.pos += 1
+        return self.data[self.pos-1]
+
+    def u32(self):
+        return self.unpack(_u32)[0]
+
+    def str(self):
+        size = self.u32()
+        self.pos += size
+        if self.pos > len(self.data):
+            raise ValueError("Truncated program")
+        return str(self.data[self.pos-size:self.pos], 'utf-8', errors='surrogatepass')
+
+    def column(self):
+        size = self.u32() * 4
+        self.pos += size
+        if self.pos > len(self.data):
+            raise ValueError("Truncated program")
+        column = array('i')
+        column.frombytes(self.data[self.pos-size:self.pos])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    def value(self):
+        tag = self.u8()
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT:
+            return self.unpack(_i64)[0]
+        if tag == BIGINT:
+            return int(self.str())
+        if tag == FLOAT:
+            return self.unpack(_f64)[0]
+        if tag == STR:
+            return self.str()
+        if tag == LIST:
+            return [self.value() for _ in range(self.u32())]
+        if tag == TUPLE:
+            return tuple(self.value() for _ in range(self.u32()))
+        if tag == VARIABLE:
+            var = variable.Variable(self.unpack(_i32)[0])
+            var._repr = self.value()
+            return var
+        if tag == SIGNATURE:
+            signature = typesData.FunctionSignature(self.u32(), [])
+            signature.inputTypes = self.value()
+            signature.returnType = self.value()
+            signature.outerVars = self.value()
+            signature.isCons = self.value()
+            return signature
+        raise ValueError("Unknown tag %d" % tag)
+
+_localKinds = {cls.__name__: idx for idx, cls in enumerate(columnar.OPERATIONS)}
+
+def deserialize(data):
+    '''The program.Program that serialize turned into data, raises ValueError if data is not one'''
+    try:
+        return _deserialize(data)
+    except (struct.error, IndexError, KeyError) as e:
+        # reads past the end, and kinds or offsets that point nowhere
+        raise ValueError("Corrupt program: %r" % e) from e
+
+def _deserialize(data):
+    reader = _Reader(data)
+    magic, version = reader.unpack(_header)
+    if magic != MAGIC:
+        raise ValueError("Not a PhpIL program")
+    if version != VERSION:
+        raise ValueError("Program has version %d, expected %d" % (version, VERSION))
+
+    columns = columnar.ColumnarProgram()
+    columns.nextVariable, numInstructions = reader.unpack(_counts)
+
+    # file kind -> local kind, and the order of its parameters in the file
+    kinds = []
+    orders = []
+    for _ in range(reader.u32()):
+        name = reader.str()
+        names = [reader.str() for _ in range(reader.u8())]
+        if name not in _localKinds:
+            raise ValueError("Unknown operation %s" % name)
+        kind = _localKinds[name]
+        local = columnar.parameterNames(columnar.OPERATIONS[kind])
+        if sorted(names) != sorted(local):
+            raise ValueError("Parameters of %s changed: %s, expected %s" % (name, names, local))
+        kinds.append(kind)
+        orders.append([names.index(n) for n in local])
+
+    for name in COLUMNS:
+        setattr(columns, name, reader.column())
+    if len(columns.kinds) != numInstructions:
+        raise ValueError("Corrupt program, %d kinds for %d instructions" % (len(columns.kinds), numInstructions))
+    columns.kinds = array('i', [kinds[kind] for kind in columns.kinds])
+    columns.opcodes = array('i', [columnar.OPCODES[kind] for kind in columns.kinds])
+
+    # the parameters are in the order of the instructions that have them
+    numParameters = reader.u32()
+    fileKinds = []
+    expected = array('i')
+    for kind in columns.kinds:
+        if len(columnar.parameterNames(columnar.OPERATIONS[kind])) > 0:
+            expected.append(len(fileKinds))
+            fileKinds.append(kind)
+        else:
+            expected.append(-1)
+    if len(fileKinds) != numParameters or columns.parameterIndex != expected:
+        raise ValueError("Corrupt parameter table")
+    kindOrders = {kinds[idx]: order for idx, order in enumerate(orders)}
+    for kind in fileKinds:
+        order = kindOrders[kind]
+        values = [reader.value() for _ in order]
+        columns.parameters.append(tuple(values[idx] for idx in order))
+
+    for _ in range(reader.u32()):
+        pos = reader.u32()
+        columns.rawInputs[pos] = reader.value()
+    for _ in range(reader.u32()):
+        varId = reader.unpack(_i32)[0]
+        columns.reprs[varId] = reader.str()
+    for offsets, column in ((columns.inputOffsets, columns.inputs), (columns.outputOffsets, columns.outputs),
+                            (columns.tempOffsets, columns.temps)):
+        if len(offsets) != numInstructions + 1 or offsets[0] != 0 or offsets[-1] != len(column) or \
+                any(offsets[idx] > offsets[idx+1] for idx in range(numInstructions)):
+            raise ValueError("Corrupt offsets")
+    if reader.pos != len(reader.data):
+        raise ValueError("Corrupt program, %d bytes after the end" % (len(reader.data) - reader.pos))
+    return columns.toProgram()
+
+def save(prog, path):
+    with open(path, 'wb') as f:
+        f.write(serialize(prog))
+
+def load(path):
+    with open(path, 'rb') as f:
+        return deserialize(f.read())
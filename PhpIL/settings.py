@@ -1,5 +1,8 @@
 from . import code_generators
+from . import mutators
 
+# the weights are cached by probability.Random.chooseWeightedBiased, code that
+# changes them while fuzzing has to call probability.Random.weightsChanged
 class Settings:
 
     allCodeGenerators = {
@@ -30,3 +33,11 @@ class Settings:
         code_generators.CodeGenerator.setArrayElemGenerator: 20,
         code_generators.CodeGenerator.builtinGenerator: 200
     }
+
+    allMutators = {
+        mutators.Mutator.inputMutator : 10,
+        mutators.Mutator.operationMutator : 10,
+        mutators.Mutator.codeGenMutator : 20,
+        mutators.Mutator.spliceMutator : 10,
+        mutators.Mutator.combineMutator : 2
+    }
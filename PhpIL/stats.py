@@ -0,0 +1,97 @@
+import json
+import time
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger('Stats')
+
+class Timer:
+    '''Adds the time spent in a with block to a timer of the tracker'''
+    def __init__(self, tracker, name):
+        self.tracker = tracker
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if self.tracker.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.tracker.addTime(self.name, time.perf_counter() - self.start)
+            self.start = None
+        return False
+
+class Stats:
+    '''
+    Timers and counters of a fuzzing run. Timers are named by what they
+    measure, e.g. "stage.execute", "generator.ifStatementGenerator" or
+    "lift.BinaryOperation", and keep the total time and the number of timed
+    calls. Generators that call generateRandomInst include the time of the
+    code they generate. Tracking is off until enable() is called so the hot
+    paths only pay for a check of the enabled flag.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+        self.reset()
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.startTime = time.time()
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    def addTime(self, name, seconds):
+        self.times[name] += seconds
+        self.calls[name] += 1
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def snapshot(self, **extra):
+        '''The current state as a dict that can be dumped to json, extra is added as is'''
+        snap = {
+            'time': time.time(),
+            'elapsed': time.time() - self.startTime,
+            'counters': dict(self.counters),
+            'timers': {name: {'total': self.times[name], 'calls': self.calls[name]} for name in self.times},
+        }
+        snap.update(extra)
+        return snap
+
+    def writeSnapshot(self, path, **extra):
+        '''Append a snapshot to path as one line of json'''
+        try:
+            with open(path, 'a') as f:
+                f.write(json.dumps(self.snapshot(**extra)) + "\n")
+        except OSError as e:
+            logger.warning("Could not write stats to %s: %r" % (path, e))
+
+    def summary(self, top=20):
+        '''A table of the counters and of the top timers by total time'''
+        elapsed = time.time() - self.startTime
+        lines = [f"stats after {elapsed:.1f}s"]
+        for name in sorted(self.counters):
+            lines.append(f"  {name:<40} {self.counters[name]}")
+        lines.append(f"  {'timer':<40} {'total(s)':>10} {'calls':>10} {'avg(us)':>10} {'%time':>6}")
+        for name in sorted(self.times, key=self.times.get, reverse=True)[:top]:
+            total = self.times[name]
+            calls = self.calls[name]
+            share = 100 * total / elapsed if elapsed > 0 else 0
+            lines.append(f"  {name:<40} {total:>10.3f} {calls:>10} {1e6 * total / calls:>10.1f} {share:>6.1f}")
+        return "\n".join(lines)
+
+# the tracker of this process
+tracker = Stats()
@@ -0,0 +1,89 @@
+<?php
+/*
+ * Persistent execution harness used by executor.Executor (persistent=True).
+ *
+ * The harness is started once with the file descriptors of two pipes:
+ *   argv[1] - control pipe, the fuzzer writes test cases here
+ *   argv[2] - status pipe, the harness writes exit statuses here
+ *
+ * Protocol (all integers are 32-bit little endian):
+ *   harness -> fuzzer : "HELO" once the interpreter is up
+ *   fuzzer -> harness : "exec" <timeout in ms> <code length> <code>
+ *   harness -> fuzzer : <exit status>
+ *
+ * Every test case runs in a forked child so the warmed-up interpreter is
+ * never polluted by the programs it runs. A child killed by a signal is
+ * reported as -signo and a child that times out as 255, which is what the
+ * non persistent executor returns in the same situations.
+ */
+
+function read_exactly($fp, $length) {
+    $data = '';
+    while (strlen($data) < $length) {
+        $chunk = fread($fp, $length - strlen($data));
+        if ($chunk === false || $chunk === '') {
+            return false;
+        }
+        $data .= $chunk;
+    }
+    return $data;
+}
+
+foreach (['pcntl_fork', 'pcntl_sigtimedwait', 'posix_kill'] as $func) {
+    if (!function_exists($func)) {
+        fwrite(STDERR, "reprl: $func is not available\n");
+        exit(1);
+    }
+}
+
+$ctrl = fopen('php://fd/' . $argv[1], 'rb');
+$status = fopen('php://fd/' . $argv[2], 'wb');
+
+fwrite($status, 'HELO');
+fflush($status);
+
+pcntl_sigprocmask(SIG_BLOCK, [SIGCHLD]);
+
+while (true) {
+    $header = read_exactly($ctrl, 12);
+    if ($header === false) {
+        exit(0);
+    }
+    $request = unpack('a4cmd/Vtimeout/Vlength', $header);
+    if ($request['cmd'] !== 'exec') {
+        fwrite(STDERR, "reprl: unknown command\n");
+        exit(1);
+    }
+    $code = $request['length'] > 0 ? read_exactly($ctrl, $request['length']) : '';
+    if ($code === false) {
+        exit(0);
+    }
+
+    $pid = pcntl_fork();
+    if ($pid === 0) {
+        fclose($ctrl);
+        fclose($status);
+        pcntl_sigprocmask(SIG_UNBLOCK, [SIGCHLD]);
+        eval('?>' . $code);
+        exit(0);
+    }
+
+    $timeout = $request['timeout'];
+    $exit_status = 255;
+    if (pcntl_sigtimedwait([SIGCHLD], $info, intdiv($timeout, 1000), ($timeout % 1000) * 1000000) === SIGCHLD) {
+        pcntl_waitpid($pid, $wstatus);
+        if (pcntl_wifsignaled($wstatus)) {
+            $exit_status = -pcntl_wtermsig($wstatus);
+        } else {
+            $exit_status = pcntl_wexitstatus($wstatus);
+        }
+    } else {
+        posix_kill($pid, SIGKILL);
+        pcntl_waitpid($pid, $wstatus);
+        // consume the SIGCHLD of the killed child so it does not end the next wait early
+        pcntl_sigtimedwait([SIGCHLD], $info, 0, 0);
+    }
+
+    fwrite($status, pack('V', $exit_status & 0xffffffff));
+    fflush($status);
+}
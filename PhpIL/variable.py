@@ -1,4 +1,5 @@
 class Variable:
+    __slots__ = ('id', '_repr')
 
     def __init__(self, id):
         self.id = id
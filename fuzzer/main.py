@@ -1,7 +1,11 @@
 import os
 import sys
 import time
+import asyncio
 import logging
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
 
 import tqdm
 
@@ -12,70 +16,525 @@ from PhpIL import program
 from PhpIL import lifter
 from PhpIL import executor
 from PhpIL import coverage
+from PhpIL import corpus
+from PhpIL import mutators
+from PhpIL import probability
+from PhpIL import stats
+from PhpIL import settings
+from PhpIL import generator_stats
+from PhpIL import crash_triage
+from PhpIL import minimizer
 
 logger = logging.getLogger('Executor')
 logging.basicConfig(level=logging.ERROR, format='%(name)s - %(levelname)s - %(message)s')
 
 
 PHP_BINARY = '/home/hacker/targets/php-phpil-asan-src/sapi/cli/php'
-SANCOV_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sancov.py")
 COVERAGE_DIR = "/tmp/coverages"
+OUTPUT_DIR = "/home/hacker/workspace"
+# read coverage from shared memory, needs php to be linked with shmcov.c
+SHM_COVERAGE = False
+# number of programs kept for their coverage
+CORPUS_SIZE = 1000
+# number of programs run by one php process when there is no persistent harness
+BATCH_SIZE = 1
+# number of php processes run at the same time while the next programs are generated,
+# 0 runs one program at a time
+IN_FLIGHT = 0
+# chance of mutating a corpus program instead of generating a new one
+MUTATION_PROBABILITY = 0.8
+# executions between two reweightings of the code generators in adaptive mode
+ADAPT_INTERVAL = 500
+# threads that test reductions of a crashing program at the same time when minimizing
+MINIMIZE_JOBS = 4
+# seconds between two reports of the aggregate stats in multi worker mode
+# and between two snapshots written to the stats file
+STATS_INTERVAL = 5
+
+class SharedState:
+    '''
+    State shared by all the workers of a multi worker run
+    '''
+    def __init__(self, shm_coverage):
+        self.execs = multiprocessing.Value('Q', 0)
+        self.crashes = multiprocessing.Value('Q', 0)
+        self.new_edges = multiprocessing.Value('Q', 0)
+        self.virgin_lock = None
+        if shm_coverage:
+            self.virgin = shared_memory.SharedMemory(create=True, size=coverage.SHM_SIZE-4)
+            self.virgin.buf[:] = b'\xff' * len(self.virgin.buf)
+            self.virgin_lock = multiprocessing.Lock()
+        else:
+            # racing updates only make two workers count the same new edge, so no lock
+            self.virgin = shared_memory.SharedMemory(create=True, size=coverage.EDGE_MAP_SIZE)
+            self.virgin.buf[:] = b'\x01' * len(self.virgin.buf)
+
+    def close(self):
+        self.virgin.close()
+        self.virgin.unlink()
 
 class Fuzzer:
-    def __init__(self, binary, args):
+    def __init__(self, binary, args, shm_coverage=SHM_COVERAGE, worker_id=None, shared=None, corpus_size=CORPUS_SIZE,
+                 stats_file=None, adaptive=False, batch_size=BATCH_SIZE, in_flight=IN_FLIGHT, minimize=False):
         self.binary = binary
+        self.batch_size = batch_size
+        self.in_flight = in_flight
         self.args = args
-        self.runner = executor.Executor(self.binary, cmdline_flags=args, is_stdin=False, output_dir='/home/hacker/workspace')
-        self.watchdog = coverage.Coverage(SANCOV_SCRIPT, output_dir='/home/hacker/workspace')
+        # the corpus is saved as it changes and picked up again on the next run
+        corpus_dir = os.path.join(OUTPUT_DIR, 'corpus')
+        if worker_id is not None:
+            corpus_dir = os.path.join(corpus_dir, f'worker{worker_id}')
+        self.corpus = corpus.Corpus(corpus_size, directory=corpus_dir)
+        self.corpus.load()
+        self.shm_coverage = shm_coverage
+        self.shared = shared
+        self.coverage_dir = COVERAGE_DIR if worker_id is None else os.path.join(COVERAGE_DIR, f'worker{worker_id}')
+
+        if self.shm_coverage:
+            if self.shared is not None:
+                self.watchdog = coverage.SharedMemoryCoverage(output_dir=OUTPUT_DIR, virgin=self.shared.virgin.buf,
+                                                              lock=self.shared.virgin_lock)
+            else:
+                self.watchdog = coverage.SharedMemoryCoverage(output_dir=OUTPUT_DIR)
+            env = self.watchdog.env()
+        else:
+            virgin = None if self.shared is None else self.shared.virgin.buf
+            self.watchdog = coverage.Coverage(output_dir=OUTPUT_DIR, virgin=virgin)
+            env = None
+        # the PCs of the last collect_feedback, see run_batch
+        self.last_pcs = None
+
+        # crashes are bucketed by their stack, all workers share the directory
+        self.crashes = crash_triage.CrashStore(os.path.join(OUTPUT_DIR, 'crashes'))
+        crash_handler = self._report_crash
+        # new crash buckets are minimized with their program, see minimize_crashes
+        self.minimize = minimize
+        self.unminimized = []
+        self.minimize_dir = os.path.join(self.coverage_dir, 'minimize')
+        if self.in_flight > 0:
+            assert not self.shm_coverage, "Shared memory coverage cannot tell apart programs that run at the same time"
+            self.runner = executor.AsyncExecutor(self.binary, cmdline_flags=args, is_stdin=False, output_dir=OUTPUT_DIR,
+                                                 env=env, coverage_dir=self.coverage_dir, crash_handler=crash_handler,
+                                                 concurrency=self.in_flight)
+        else:
+            # batches amortize the start of php, which the persistent harness already avoids
+            self.runner = executor.Executor(self.binary, cmdline_flags=args, is_stdin=False, output_dir=OUTPUT_DIR,
+                                            persistent=self.batch_size <= 1, env=env, coverage_dir=self.coverage_dir,
+                                            crash_handler=crash_handler)
         self.start_time = time.time()
 
-        os.system(f"mkdir -p {COVERAGE_DIR}")
+        # timings of the stages, generators and opcodes, see PhpIL/stats.py
+        self.worker_id = worker_id
+        self.stats_file = stats_file
+        self.last_stats = time.time()
+        if self.stats_file is not None:
+            stats.tracker.enable()
 
-    def generate_input(self):
+        # reweight the code generators by what they yield, see PhpIL/generator_stats.py
+        self.adaptive = adaptive
+        self.execs = 0
+        self.next_adapt = ADAPT_INTERVAL
+        if self.adaptive or self.stats_file is not None:
+            generator_stats.tracker.enable()
+
+        os.makedirs(self.coverage_dir, exist_ok=True)
+
+    def _report_crash(self, exit_code, code, output, err):
+        bucket, new = self.crashes.add(exit_code, code, output, err)
+        stats.tracker.count('crash_buckets', int(new))
+        if new:
+            print(f"new crash: {bucket}")
+            if self.minimize:
+                self.unminimized.append(bucket)
+
+    def _minimize_executor(self):
+        # coverage of the minimization runs must not count as coverage of the fuzzer
+        return executor.Executor(self.binary, cmdline_flags=self.args, output_dir=OUTPUT_DIR, persistent=True,
+                                 coverage_dir=self.minimize_dir)
+
+    def take_unminimized(self):
+        """
+        the crash buckets found since the last call that still have to be minimized
+        """
+        buckets = self.unminimized
+        self.unminimized = []
+        return buckets
+
+    def minimize_crashes(self, progs, buckets=None):
+        """
+        minimize the programs of buckets, by default the crash buckets found since the last call.
+        progs are the programs that might have crashed. The results go to the crash store.
+        This runs up to a thousand programs per bucket, so it blocks for a while
+        """
+        if buckets is None:
+            buckets = self.take_unminimized()
+        if len(buckets) == 0:
+            return
+        with stats.tracker.timer('stage.minimize'):
+            minimized = self.minimize_programs(progs, buckets)
+        self.save_minimized(minimized)
+
+    def minimize_programs(self, progs, buckets):
+        """
+        returns the minimized code of every bucket of buckets that one of progs crashes with.
+        It only uses executors of its own and no state of the fuzzer, so it can run in another thread
+        """
+        os.makedirs(self.minimize_dir, exist_ok=True)
+        minimized = []
+        for bucket in buckets:
+            test = minimizer.CrashTest(self._minimize_executor, bucket)
+            try:
+                for prog in progs:
+                    smallest = minimizer.Minimizer(test, jobs=MINIMIZE_JOBS).minimize(prog)
+                    if smallest is not None:
+                        lift = lifter.Lifter(smallest, tracker=test.stats)
+                        lift.doLifting()
+                        minimized.append((bucket, lift.getCode()))
+                        break
+            finally:
+                test.close()
+        return minimized
+
+    def save_minimized(self, minimized):
+        """
+        store the results of minimize_programs and remove the coverage of the minimization runs
+        """
+        for bucket, code in minimized:
+            self.crashes.save_minimized(bucket, code)
+        self.watchdog.clear_reports(self.minimize_dir)
+
+    def generate_program(self):
         pb = program_builder.ProgramBuilder(init_builtins=True)
         for _ in range(4):
             pb.generateRandomInst()
 
-        prog = pb.finish()
+        return pb.finish()
+
+    def mutate_program(self):
+        """
+        mutate a program from the corpus, returns None if there is nothing to mutate
+        """
+        if len(self.corpus) == 0 or not probability.Random.probability(MUTATION_PROBABILITY):
+            return None
+        return mutators.Mutator.mutate(self.corpus.randomElement(), self.corpus)
+
+    def next_program(self):
+        with stats.tracker.timer('stage.mutate'):
+            prog = self.mutate_program()
+        if prog is None:
+            stats.tracker.count('programs.generated')
+            with stats.tracker.timer('stage.generate'):
+                prog = self.generate_program()
+        else:
+            stats.tracker.count('programs.mutated')
+        return prog
 
-        lift = lifter.Lifter(prog)
-        lift.doLifting()
-        code = lift.getCode()
-        return code
+    def generate_input(self):
+        prog = self.next_program()
+        with stats.tracker.timer('stage.lift'):
+            lift = lifter.Lifter(prog)
+            lift.doLifting()
+        # the executor streams the emitter into its input file
+        return prog, lift.emitter
 
-    def collect_feedback(self):
-        for sancov_file in self.watchdog.find_reports(COVERAGE_DIR):
-            self.watchdog.analyze(obj=self.binary, report_file=sancov_file)
-        self.watchdog.clear_reports(COVERAGE_DIR)
+    def collect_feedback(self, update=True, pid=None):
+        """
+        returns the number of new edges found by the executions since the last call, or only by
+        the php process pid if it is given. They are only counted and not marked as seen if update is False.
+        The PCs of the .sancov files are kept in last_pcs
+        """
+        self.last_pcs = None
+        if self.shm_coverage:
+            return self.watchdog.analyze(update=update)
+
+        new_edges = 0
+        reports = self.watchdog.find_reports(self.coverage_dir, pid=pid)
+        if len(reports) > 0:
+            self.last_pcs = self.watchdog.analyze(obj=self.binary, report_file=reports, update=update)
+            new_edges = self.watchdog.last_new_edges
+        self.watchdog.clear_reports(self.coverage_dir, pid=pid)
+        return new_edges
 
     def run_once(self):
         """
-        finish one fuzzing iteration
+        finish one fuzzing iteration, returns the exit codes of the programs that ran and the number of new edges
         """
-        # Mutate code
-        code = self.generate_input()
+        if self.batch_size > 1:
+            return self.run_batch()
+
+        prog, code = self.generate_input()
         self.runner.code = code
-        output, err, exit_code = self.runner.execute()
-        print(f"exit_code: {exit_code}")
-        self.collect_feedback()
+        with stats.tracker.timer('stage.execute'):
+            output, err, exit_code = self.runner.execute(collect_stderr=True)
+        with stats.tracker.timer('stage.feedback'):
+            new_edges = self.collect_feedback()
+        with stats.tracker.timer('stage.corpus'):
+            self.corpus.add(prog, new_edges)
+        self.minimize_crashes([prog])
+
+        self.account([exit_code], new_edges)
+        return [exit_code], new_edges
+
+    def run_batch(self):
+        """
+        run batch_size programs in one php process. When the batch finds new edges its programs
+        are run again one by one, so that each of them is kept for the edges it finds on its own
+        """
+        progs = [self.next_program() for _ in range(self.batch_size)]
+        with stats.tracker.timer('stage.lift'):
+            batch = lifter.BatchLifter(progs)
+            batch.doLifting()
+        with stats.tracker.timer('stage.execute'):
+            results = self.runner.execute_batch(batch, collect_stderr=True)
+        with stats.tracker.timer('stage.feedback'):
+            new_edges = self.collect_feedback(update=False)
+            batch_pcs = self.last_pcs
+
+        if new_edges > 0:
+            new_edges = 0
+            for idx, prog in enumerate(progs):
+                # crashes were recorded by the batch already
+                self.runner.code = batch.subset([idx])
+                with stats.tracker.timer('stage.execute'):
+                    self.runner.execute(record=False)
+                with stats.tracker.timer('stage.feedback'):
+                    edges = self.collect_feedback()
+                with stats.tracker.timer('stage.corpus'):
+                    self.corpus.add(prog, edges)
+                new_edges += edges
+            if batch_pcs is not None:
+                # edges are pairs of neighbouring PCs, the merged PCs of the batch have pairs across programs
+                # that none of them has on its own. They would make every later batch look new
+                self.watchdog.mark_seen(batch_pcs)
+
+        self.minimize_crashes([prog for prog, (_, exit_code) in zip(progs, results)
+                               if exit_code not in executor.BORING_EXIT_CODES])
+        exit_codes = [exit_code for _, exit_code in results]
+        self.account(exit_codes, new_edges)
+        return exit_codes, new_edges
+
+    async def run_async(self, report):
+        """
+        fuzz with in_flight php processes running while the next programs are generated and lifted,
+        report is called with the exit codes and the number of new edges of every program that ran
+        """
+        inputs = asyncio.Queue(maxsize=2 * self.in_flight)
+        tasks = [asyncio.create_task(self.produce(inputs))]
+        tasks += [asyncio.create_task(self.consume(inputs, report)) for _ in range(self.in_flight)]
+        await asyncio.gather(*tasks)
+
+    async def produce(self, inputs):
+        while True:
+            try:
+                prog, code = self.generate_input()
+                # the program is rewarded once it ran, after the next ones were generated
+                generators = generator_stats.tracker.take() if generator_stats.tracker.enabled else None
+            except Exception as e:
+                logger.exception(e)
+            else:
+                await inputs.put((prog, code, generators))
+            # let the finished runs be handled before generating the next program
+            await asyncio.sleep(0)
+
+    async def consume(self, inputs, report):
+        while True:
+            prog, code, generators = await inputs.get()
+            try:
+                # runs overlap, so there is no stage.execute timer in this mode
+                output, err, exit_code, pid = await self.runner.execute_async(code, collect_stderr=True)
+                with stats.tracker.timer('stage.feedback'):
+                    new_edges = self.collect_feedback(pid=pid)
+                with stats.tracker.timer('stage.corpus'):
+                    self.corpus.add(prog, new_edges)
+                self.account([exit_code], new_edges, generators)
+                report([exit_code], new_edges)
+                buckets = self.take_unminimized()
+                if len(buckets) > 0:
+                    # minimizing blocks, the other runs go on while a thread does it. The results
+                    # are stored here, the thread does not touch the crash store or the watchdog
+                    minimized = await asyncio.get_running_loop().run_in_executor(
+                        None, self.minimize_programs, [prog], buckets)
+                    self.save_minimized(minimized)
+            except Exception as e:
+                logger.exception(e)
+
+    def account(self, exit_codes, new_edges, generators=None):
+        """
+        update the stats with the outcome of one iteration, generators are the code generators
+        of the program if they were taken from the generator stats when it was generated
+        """
+        if generator_stats.tracker.enabled:
+            generator_stats.tracker.reward(new_edges, generators)
+        self.execs += len(exit_codes)
+        if self.adaptive and self.execs >= self.next_adapt:
+            self.next_adapt += ADAPT_INTERVAL
+            generator_stats.tracker.adapt(settings.Settings.allCodeGenerators)
+
+        stats.tracker.count('execs', len(exit_codes))
+        stats.tracker.count('new_edges', new_edges)
+        stats.tracker.count('crashes', sum(exit_code not in executor.BORING_EXIT_CODES for exit_code in exit_codes))
+        if self.stats_file is not None and time.time() - self.last_stats >= STATS_INTERVAL:
+            self.write_stats()
+
+    def write_stats(self):
+        self.last_stats = time.time()
+        stats.tracker.writeSnapshot(self.stats_file, worker=self.worker_id, corpus=len(self.corpus),
+                                    generators=generator_stats.tracker.snapshot())
+
+    def report_stats(self):
+        """
+        write a last snapshot and print the summary, called on shutdown
+        """
+        if self.stats_file is None:
+            return
+        self.write_stats()
+        prefix = "" if self.worker_id is None else f"worker {self.worker_id} "
+        print(prefix + stats.tracker.summary())
+
+    def dump(self):
+        print("saving coverage...")
+        print(self.crashes.summary())
+        if self.shm_coverage:
+            self.watchdog.dump_coverage('coverage.bitmap')
+        else:
+            self.watchdog.dump_coverage('coverage.bin')
 
     def run(self):
         pbar = tqdm.tqdm(bar_format="\rexec speed: {rate}\n")
+
+        def report(exit_codes, _):
+            pbar.update(len(exit_codes))
+            print(f"exit_code: {' '.join(str(exit_code) for exit_code in exit_codes)}")
+
         while True:
             try:
-                print(f"crash_num: {self.runner.crash_num}")
-                pbar.update(1)
-                self.run_once()
+                print(f"crash_num: {self.runner.crash_num} corpus: {len(self.corpus)}")
+                if self.in_flight > 0:
+                    asyncio.run(self.run_async(report))
+                else:
+                    report(*self.run_once())
             except KeyboardInterrupt:
-                print("saving input and coverage...")
-                self.runner.dump_inputs(filename='fuzzer_inputs.json')
-                self.watchdog.dump_coverage('coverage.json')
+                self.dump()
+                self.report_stats()
                 time.sleep(1)
             except Exception as e:
                 logger.exception(e)
 
+    def run_worker(self):
+        """
+        fuzz forever and report to the shared state, used by the workers of a multi worker run
+        """
+        while True:
+            try:
+                if self.in_flight > 0:
+                    asyncio.run(self.run_async(self.share))
+                else:
+                    self.share(*self.run_once())
+            except KeyboardInterrupt:
+                # the orchestrator does the saving
+                break
+            except Exception as e:
+                logger.exception(e)
+
+    def share(self, exit_codes, new_edges):
+        with self.shared.execs.get_lock():
+            self.shared.execs.value += len(exit_codes)
+        if new_edges > 0:
+            with self.shared.new_edges.get_lock():
+                self.shared.new_edges.value += new_edges
+        crashes = sum(exit_code not in executor.BORING_EXIT_CODES for exit_code in exit_codes)
+        if crashes > 0:
+            with self.shared.crashes.get_lock():
+                self.shared.crashes.value += crashes
+
+def worker_main(worker_id, binary, args, shm_coverage, shared, corpus_size, stats_file, adaptive, batch_size, in_flight,
+                minimize):
+    fuzzer = Fuzzer(binary, args, shm_coverage=shm_coverage, worker_id=worker_id, shared=shared, corpus_size=corpus_size,
+                    stats_file=stats_file, adaptive=adaptive, batch_size=batch_size, in_flight=in_flight,
+                    minimize=minimize)
+    fuzzer.run_worker()
+    fuzzer.report_stats()
+    fuzzer.runner.close()
+    if shm_coverage:
+        fuzzer.watchdog.close()
+
+def run_workers(binary, args, num_workers, shm_coverage, corpus_size, stats_file=None, adaptive=False,
+                batch_size=BATCH_SIZE, in_flight=IN_FLIGHT, minimize=False):
+    """
+    run num_workers fuzzers in parallel, they share the crashes and the coverage map
+    but every worker keeps its own corpus
+    """
+    shared = SharedState(shm_coverage)
+    workers = []
+    for worker_id in range(num_workers):
+        worker_args = (worker_id, binary, args, shm_coverage, shared, corpus_size, stats_file, adaptive, batch_size,
+                       in_flight, minimize)
+        p = multiprocessing.Process(target=worker_main, args=worker_args, daemon=True)
+        p.start()
+        workers.append(p)
+
+    start_time = time.time()
+    last_report = start_time
+    while True:
+        try:
+            time.sleep(1)
+            if time.time() - last_report < STATS_INTERVAL:
+                continue
+            last_report = time.time()
+            execs = shared.execs.value
+            alive = sum(p.is_alive() for p in workers)
+            print(f"workers: {alive}/{num_workers} execs: {execs} "
+                  f"exec speed: {execs / (last_report - start_time):.2f}/s "
+                  f"crash_num: {shared.crashes.value} new edges: {shared.new_edges.value}")
+        except KeyboardInterrupt:
+            print("saving coverage...")
+            for p in workers:
+                p.join(timeout=5)
+                if p.is_alive():
+                    p.terminate()
+            # the workers wrote their crashes to the crash store themselves
+            print(crash_triage.CrashStore(os.path.join(OUTPUT_DIR, 'crashes')).summary())
+            if shm_coverage:
+                with open(os.path.join(OUTPUT_DIR, 'coverage.bitmap'), 'wb') as f:
+                    f.write(shared.virgin.buf)
+            else:
+                coverage.dump_edge_map(os.path.join(OUTPUT_DIR, 'coverage.bin'), shared.virgin.buf)
+            shared.close()
+            break
+
 def main():
-    fuzzer = Fuzzer(PHP_BINARY, ['-c', '/home/hacker/php.ini'])
+    parser = argparse.ArgumentParser(description='Fuzz php with PhpIL generated programs')
+    parser.add_argument('--binary', default=PHP_BINARY, help='the php binary to fuzz')
+    parser.add_argument('--workers', type=int, default=1, help='the number of fuzzing processes')
+    parser.add_argument('--shm-coverage', action='store_true', default=SHM_COVERAGE,
+                        help='read coverage from shared memory, needs php to be linked with shmcov.c')
+    parser.add_argument('--corpus-size', type=int, default=CORPUS_SIZE,
+                        help='the number of programs kept for their coverage')
+    parser.add_argument('--stats', metavar='FILE', default=None,
+                        help='time the fuzzing stages, code generators and opcodes and append snapshots to FILE as json lines')
+    parser.add_argument('--adaptive', action='store_true', default=False,
+                        help='reweight the code generators by how often they fail and how much coverage they find')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE,
+                        help='run this many programs per php process instead of using the persistent harness')
+    parser.add_argument('--in-flight', type=int, default=IN_FLIGHT,
+                        help='run this many php processes at the same time while the next programs are generated, '
+                             'without the persistent harness')
+    parser.add_argument('--minimize', action='store_true', default=False,
+                        help='minimize the program of every new crash bucket, see PhpIL/minimizer.py. '
+                             'This pauses fuzzing while a crash is minimized, except with --in-flight')
+    args = parser.parse_args()
+    if args.in_flight > 0 and args.shm_coverage:
+        parser.error('--in-flight needs the .sancov coverage, not --shm-coverage')
+
+    php_args = ['-c', '/home/hacker/php.ini']
+    if args.workers > 1:
+        run_workers(args.binary, php_args, args.workers, args.shm_coverage, args.corpus_size, args.stats, args.adaptive,
+                    args.batch, args.in_flight, args.minimize)
+        return
+
+    fuzzer = Fuzzer(args.binary, php_args, shm_coverage=args.shm_coverage, corpus_size=args.corpus_size,
+                    stats_file=args.stats, adaptive=args.adaptive, batch_size=args.batch, in_flight=args.in_flight,
+                    minimize=args.minimize)
     fuzzer.run()
 
 if __name__ == '__main__':
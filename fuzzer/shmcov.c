@@ -0,0 +1,80 @@
+/*
+ * Edge coverage over shared memory, read by coverage.SharedMemoryCoverage.
+ *
+ * Build php with -fsanitize-coverage=trace-pc-guard and link this file into
+ * the binary. It replaces the sanitizer's default guard callbacks, so the
+ * binary no longer writes .sancov files.
+ *
+ * The fuzzer exports the name of a POSIX shared memory object in SHM_ID. The
+ * object is laid out as
+ *
+ *     uint32_t num_edges;
+ *     uint8_t  bitmap[SHM_SIZE - 4];
+ *
+ * where bit i of the bitmap is set once edge i has been executed. Without
+ * SHM_ID the bitmap lives in private memory and nobody reads it.
+ */
+#include <fcntl.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#define SHM_SIZE 0x100000
+#define MAX_EDGES ((SHM_SIZE - 4) * 8)
+
+struct shmem_data {
+    uint32_t num_edges;
+    unsigned char edges[];
+};
+
+static struct shmem_data *shmem;
+
+static void map_shmem(void) {
+    const char *shm_key = getenv("SHM_ID");
+    if (!shm_key) {
+        shmem = calloc(1, SHM_SIZE);
+        return;
+    }
+
+    int fd = shm_open(shm_key, O_RDWR, S_IRUSR | S_IWUSR);
+    if (fd < 0) {
+        fprintf(stderr, "shmcov: failed to open shared memory %s\n", shm_key);
+        _exit(-1);
+    }
+    shmem = mmap(0, SHM_SIZE, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (shmem == MAP_FAILED) {
+        fprintf(stderr, "shmcov: failed to mmap shared memory %s\n", shm_key);
+        _exit(-1);
+    }
+}
+
+void __sanitizer_cov_trace_pc_guard_init(uint32_t *start, uint32_t *stop) {
+    if (start == stop || *start)
+        return;
+
+    if (!shmem)
+        map_shmem();
+
+    /*
+     * keep numbering across the modules of this process so every edge has its
+     * own bit. The count starts at 0 in every process, so an edge gets the same
+     * bit each time php starts. The header only tells the fuzzer the total.
+     */
+    static uint32_t num_edges;
+    for (uint32_t *x = start; x < stop && num_edges < MAX_EDGES - 1; x++)
+        *x = ++num_edges;
+    shmem->num_edges = num_edges;
+}
+
+void __sanitizer_cov_trace_pc_guard(uint32_t *guard) {
+    uint32_t index = *guard;
+    if (!index)
+        return;
+    shmem->edges[index / 8] |= 1 << (index % 8);
+    /* an edge only needs to be recorded once per process */
+    *guard = 0;
+}
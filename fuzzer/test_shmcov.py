@@ -0,0 +1,83 @@
+'''
+Checks that fuzzer/shmcov.c gives an edge the same bit in every process.
+A small target stands in for php: it registers two modules of guards the
+way -fsanitize-coverage=trace-pc-guard does and hits a few of them.
+
+Run it with pytest or as a script, it needs a C compiler.
+'''
+import os
+import shutil
+import subprocess
+import tempfile
+from multiprocessing import shared_memory
+
+# must match SHM_SIZE in fuzzer/shmcov.c
+SHM_SIZE = 0x100000
+SHMCOV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shmcov.c')
+
+TARGET = r'''
+#include <stdint.h>
+
+void __sanitizer_cov_trace_pc_guard_init(uint32_t *start, uint32_t *stop);
+void __sanitizer_cov_trace_pc_guard(uint32_t *guard);
+
+static uint32_t module_a[100];
+static uint32_t module_b[50];
+
+int main(void) {
+    __sanitizer_cov_trace_pc_guard_init(module_a, module_a + 100);
+    __sanitizer_cov_trace_pc_guard_init(module_b, module_b + 50);
+    __sanitizer_cov_trace_pc_guard(&module_a[3]);
+    __sanitizer_cov_trace_pc_guard(&module_a[99]);
+    __sanitizer_cov_trace_pc_guard(&module_b[7]);
+    return 0;
+}
+'''
+
+def build_target(directory):
+    compiler = shutil.which('cc') or shutil.which('gcc') or shutil.which('clang')
+    if compiler is None:
+        return None
+    source = os.path.join(directory, 'target.c')
+    binary = os.path.join(directory, 'target')
+    with open(source, 'w') as f:
+        f.write(TARGET)
+    subprocess.run([compiler, '-o', binary, source, SHMCOV], check=True)
+    return binary
+
+def run_target(binary, shm):
+    subprocess.run([binary], env=dict(os.environ, SHM_ID=f'/{shm.name}'), check=True)
+    num_edges = int.from_bytes(shm.buf[:4], 'little')
+    bitmap = bytes(shm.buf[4:])
+    # what SharedMemoryCoverage.analyze does after every execution
+    shm.buf[4:] = bytes(SHM_SIZE - 4)
+    return num_edges, bitmap
+
+def test_same_bitmap_every_run():
+    with tempfile.TemporaryDirectory() as directory:
+        binary = build_target(directory)
+        if binary is None:
+            try:
+                import pytest
+            except ImportError:
+                print("skipped, no C compiler")
+                return
+            pytest.skip("no C compiler")
+
+        shm = shared_memory.SharedMemory(create=True, size=SHM_SIZE)
+        try:
+            first = run_target(binary, shm)
+            second = run_target(binary, shm)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    assert first[0] == second[0] == 150
+    assert first[1] == second[1]
+    hit = [idx for idx in range(len(first[1]) * 8) if first[1][idx // 8] & (1 << (idx % 8))]
+    # the guards are numbered from 1, module_b follows module_a
+    assert hit == [4, 100, 108]
+
+if __name__ == '__main__':
+    test_same_bitmap_every_run()
+    print("ok")
@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from PhpIL import program_builder
+from PhpIL import lifter
+
+
+def generate_programs(num_programs, num_insts):
+    programs = []
+    for _ in range(num_programs):
+        pb = program_builder.ProgramBuilder(init_builtins=True)
+        for _ in range(num_insts):
+            pb.generateRandomInst()
+        programs.append(pb.finish())
+    return programs
+
+def bench(programs, rounds):
+    lifts = 0
+    insts = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for prog in programs:
+            lift = lifter.Lifter(prog)
+            lift.doLifting()
+            lift.getCode()
+            lifts += 1
+            insts += len(prog.instructionList)
+    elapsed = time.perf_counter() - start
+    return lifts / elapsed, insts / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how fast generated programs are lifted to php')
+    parser.add_argument('--programs', type=int, default=200, help='the number of programs to generate')
+    parser.add_argument('--insts', type=int, default=20, help='the number of generateRandomInst calls per program')
+    parser.add_argument('--rounds', type=int, default=20, help='how many times every program is lifted')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    programs = generate_programs(args.programs, args.insts)
+    total = sum(len(prog.instructionList) for prog in programs)
+    print(f"{len(programs)} programs, {total / len(programs):.1f} instructions on average")
+
+    lifts, insts = bench(programs, args.rounds)
+    print(f"{lifts:.0f} lifts/s, {insts:.0f} instructions/s")
+
+if __name__ == '__main__':
+    main()
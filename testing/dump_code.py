@@ -59,7 +59,7 @@ def main():
     watchdog.clear_reports('/tmp/coverages')
     print(code)
     #runner.dump_inputs('/home/hacker/workspace/fuzzer_inputs.json')
-    #watchdog.dump_coverage('/home/hacker/workspace/coverage.json')
+    #watchdog.dump_coverage('/home/hacker/workspace/coverage.bin')
 
 
 if __name__ == '__main__':
@@ -40,7 +40,7 @@ def main():
             watchdog.clear_reports('/tmp/coverages')
         except:
             runner.dump_inputs('fuzzer_inputs.json')
-            watchdog.dump_coverage('coverage.json')
+            watchdog.dump_coverage('coverage.bin')
             break
 
 
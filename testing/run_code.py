@@ -29,7 +29,7 @@ def main():
         watchdog.analyze(obj=PHP_BINARY, report_file=sancov_file)
     watchdog.clear_reports('/tmp/coverages')
     runner.dump_inputs('/home/hacker/workspace/fuzzer_inputs.json')
-    watchdog.dump_coverage('/home/hacker/workspace/coverage.json')
+    watchdog.dump_coverage('/home/hacker/workspace/coverage.bin')
 
 
 if __name__ == '__main__':